@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - benchmarks
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Times get_seq, circuit construction, compile, run and result parse
+separately for qubits 1..qubits_max, chain lengths 1..chain, with and
+without H, on every local backend. Writes JSON results and compares them
+with a stored baseline.
+
+python3 bench.py --qubits-max 4 --chain 3 --save-baseline
+python3 bench.py --qubits-max 4 --chain 3 --baseline bench_baseline.json
+'''
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+
+from libqc import QC, SPARSE_BACKEND, UNSUPPORTED_BACKENDS, qiskit_errors
+from libengine import EngineError, optimize_gates, run_sparse, sample_counts
+
+PHASES = ('get_seq', 'build', 'compile', 'run', 'result_parse')
+
+
+def expression(qubits, chain, superposed, seed=1):
+    '''
+    reproducible expression of chain operations on qubits wide operands,
+    the first operand is H if superposed is True
+    '''
+    rand = random.Random('{0}/{1}/{2}'.format(seed, qubits, chain))
+    operands = [str(rand.randrange(2**qubits)) for _ in range(chain + 1)]
+    if superposed is True:
+        operands[0] = 'H'
+    text = operands[0]
+    for operand in operands[1:]:
+        text += rand.choice('+-') + operand
+    return text
+
+
+def timed(func, *args, **kwargs):
+    '''
+    (seconds, return value) of func
+    '''
+    start = time.perf_counter()
+    value = func(*args, **kwargs)
+    return (time.perf_counter() - start, value)
+
+
+def bench_qiskit(qc, text):
+    '''
+    seconds of each phase on a QISKit backend
+    '''
+    seconds = {}
+    (seconds['get_seq'], seq) = timed(qc.get_seq, text)
+    (seconds['build'], _) = timed(qc._define_circuit, seq)
+    (seconds['compile'], qobj) = timed(qc._compile, 'qcirc',
+                                       shots=qc._shots(seq))
+    (seconds['run'], result) = timed(qc._run, qobj)
+    (seconds['result_parse'], _) = timed(qc.result_parse, result)
+    return seconds
+
+
+def bench_sparse(qc, text):
+    '''
+    seconds of each phase on the sparse simulator
+    (compile is the gate optimization of libengine)
+    '''
+    seconds = {}
+    (seconds['get_seq'], seq) = timed(qc.get_seq, text)
+    (seconds['build'], circuit) = timed(qc._build_gatelist, seq)
+    (seconds['compile'], (circuit.gates, _stats)) = timed(optimize_gates,
+                                                          circuit.gates)
+    (seconds['run'], probabilities) = timed(run_sparse, circuit)
+    counts = sample_counts(probabilities, qc._shots(seq))
+    (seconds['result_parse'], _) = timed(qc._parse_counts, counts)
+    return seconds
+
+
+def run_benchmarks(backends, qubits_max, chain_max, repeat):
+    '''
+    list of result dicts, the seconds of each phase are the minimum of
+    repeat runs (the median is kept as well)
+    '''
+    # pylint: disable=protected-access
+    results = []
+    for backend in backends:
+        qc = QC(backend=backend, fastpath=False)
+        bench = bench_sparse if backend == SPARSE_BACKEND else bench_qiskit
+        for qubits in range(1, qubits_max + 1):
+            qc.set_config({'qubits': qubits})
+            for chain in range(1, chain_max + 1):
+                for superposed in (False, True):
+                    text = expression(qubits, chain, superposed)
+                    entry = {'key': '{0}/q{1}/c{2}/{3}'.format(
+                        backend, qubits, chain, 'h' if superposed else 'n'),
+                             'backend': backend, 'qubits': qubits,
+                             'chain': chain, 'superposed': superposed,
+                             'expression': text}
+                    try:
+                        runs = [bench(qc, text) for _ in range(repeat)]
+                    except ((EngineError, MemoryError, KeyError) +
+                            qiskit_errors()) as ex:
+                        # KeyError: a backend without counts
+                        entry['error'] = str(ex)
+                    else:
+                        entry['seconds'] = {
+                            phase: min(run[phase] for run in runs)
+                            for phase in PHASES}
+                        entry['median'] = {
+                            phase: statistics.median(run[phase]
+                                                     for run in runs)
+                            for phase in PHASES}
+                    results.append(entry)
+                    sys.stderr.write('{0:<48} {1}\n'.format(
+                        entry['key'], 'error' if 'error' in entry else
+                        '{:.6f} sec'.format(sum(entry['seconds'].values()))))
+    return results
+
+
+def compare(results, baseline, threshold=0.2, floor=1e-4):
+    '''
+    regressions [(key, phase, baseline seconds, seconds)]: slower than
+    baseline by more than threshold (ratio) and floor (seconds)
+    '''
+    base = {entry['key']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = base.get(entry['key'])
+        if old is None or 'seconds' not in old or 'seconds' not in entry:
+            continue
+        for phase in PHASES:
+            (before, after) = (old['seconds'][phase], entry['seconds'][phase])
+            if after > before * (1 + threshold) and after - before > floor:
+                regressions.append((entry['key'], phase, before, after))
+    return regressions
+
+
+def parse_args(argv=None):
+    '''
+    parse command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Quantum Calculator '
+                                     'benchmarks')
+    parser.add_argument('--qubits-max', type=int, default=8)
+    parser.add_argument('--chain', type=int, default=3,
+                        help='longest chain of operations')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--backend', action='append', default=None,
+                        help='backend to run (repeatable), '
+                        'default every local backend')
+    parser.add_argument('--output', default='bench_output.json')
+    parser.add_argument('--baseline', default='bench_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slow down ratio before a regression')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    '''
+    main, returns 1 if a regression against the baseline was found
+    '''
+    args = parse_args(argv)
+    backends = args.backend
+    if backends is None:
+        backends = [backend for backend in QC().backends
+                    if backend.startswith('local_') and
+                    backend not in UNSUPPORTED_BACKENDS]
+
+    results = run_benchmarks(backends, args.qubits_max, args.chain,
+                             args.repeat)
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'repeat': args.repeat},
+              'results': results}
+    with open(args.output, 'w') as fp:
+        json.dump(report, fp, indent=1)
+    if args.save_baseline is True:
+        with open(args.baseline, 'w') as fp:
+            json.dump(report, fp, indent=1)
+        return 0
+
+    try:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    except (OSError, ValueError):
+        sys.stdout.write('no baseline {0}\n'.format(args.baseline))
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for (key, phase, before, after) in regressions:
+        sys.stdout.write('regression {0:<48} {1:<12} {2:.6f} -> {3:.6f} sec'
+                         '\n'.format(key, phase, before, after))
+    sys.stdout.write('{0} regression{1} against {2}\n'
+                     .format(len(regressions),
+                             '' if len(regressions) == 1 else 's',
+                             args.baseline))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
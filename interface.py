@@ -7,31 +7,51 @@ Licence: Apache License 2.0
 '''
 
 import sys
-import time
-import threading
 import os
 import configparser
 import wx
 
-from libqc import QC
+from libqc import QC, UNSUPPORTED_BACKENDS
+from libparse import Parser, ParseError
 
 VERSION_TEXT = '0.0.2'
 CONFIG_FILENAME = './default.conf'
 
-# default configure load
+# default configure, read by load_config()
 CONF = configparser.ConfigParser()
-if os.path.isfile(CONFIG_FILENAME) is False:
-    sys.stdout.write('{0} not found -> init\n'.format(CONFIG_FILENAME))
-    CONF['DEFAULT'] = {
-        'backend': 'local_qasm_simulator',
-        'remote': 'no',
-        'qubits': '3',
-        'qubits_max': '8',
-        'qubits_min': '1'
-        }
-    with open(CONFIG_FILENAME, 'w') as fp:
-        CONF.write(fp)
-CONF.read(CONFIG_FILENAME)
+CONF['DEFAULT'] = {
+    'backend': 'local_qasm_simulator',
+    'remote': 'no',
+    'qubits': '3',
+    'qubits_max': '8',
+    'qubits_min': '1',
+    'fastpath': 'yes',
+    'cache_dir': '',
+    'optimize': 'yes',
+    'exact': 'no',
+    'adder': 'auto',
+    'adaptive': 'no',
+    'confidence': '0.95',
+    'tolerance': '0.05',
+    'shots_max': '8192',
+    'profile': 'no',
+    'profile_dir': 'profiles',
+    'memory_budget': '1073741824',
+    'job_db': '',
+    'job_rate': '6'
+    }
+
+
+def load_config(filename=CONFIG_FILENAME):
+    '''
+    load configure file, write the default one if it does not exist
+    '''
+    if os.path.isfile(filename) is False:
+        sys.stdout.write('{0} not found -> init\n'.format(filename))
+        with open(filename, 'w') as fp:
+            CONF.write(fp)
+    CONF.read(filename)
+    return CONF
 
 
 class Calculator(wx.Frame):
@@ -49,10 +69,27 @@ class Calculator(wx.Frame):
                                                 wx.RESIZE_BORDER ^
                                                 wx.MAXIMIZE_BOX))
 
+        load_config()
         self.__qc = QC(backend=CONF['DEFAULT'].get('backend',
                                                    'local_qasm_simulator'),
                        remote=CONF['DEFAULT'].getboolean('remote'),
-                       qubits=CONF['DEFAULT'].getint('qubits', 3))
+                       qubits=CONF['DEFAULT'].getint('qubits', 3),
+                       fastpath=CONF['DEFAULT'].getboolean('fastpath', True),
+                       cache_dir=CONF['DEFAULT'].get('cache_dir', ''),
+                       optimize=CONF['DEFAULT'].getboolean('optimize', True),
+                       exact=CONF['DEFAULT'].getboolean('exact', False))
+        self.__qc.set_config({
+            'adder': CONF['DEFAULT'].get('adder', 'auto'),
+            'adaptive': CONF['DEFAULT'].getboolean('adaptive', False),
+            'confidence': CONF['DEFAULT'].getfloat('confidence', 0.95),
+            'tolerance': CONF['DEFAULT'].getfloat('tolerance', 0.05),
+            'shots_max': CONF['DEFAULT'].getint('shots_max', 8192),
+            'profile': CONF['DEFAULT'].getboolean('profile', False),
+            'profile_dir': CONF['DEFAULT'].get('profile_dir', 'profiles'),
+            'memory_budget': CONF['DEFAULT'].getint('memory_budget',
+                                                    2**30),
+            'job_db': CONF['DEFAULT'].get('job_db', ''),
+            'job_rate': CONF['DEFAULT'].getfloat('job_rate', 6.0)})
 
         # flags
         self.busy = False
@@ -212,11 +249,7 @@ class Menu(wx.MenuBar):
             self.__qc.load()
         backends = self.__qc.backends
 
-        disable_backends = [
-            'local_unitary_simulator',
-            'local_clifford_simulator',
-            'ibmqx4'
-            ]
+        disable_backends = list(UNSUPPORTED_BACKENDS) + ['ibmqx4']
 
         # disable
         for backend in backends[:]:
@@ -280,6 +313,8 @@ class CalcButtonPanel(wx.Panel):
         self.frame = parent.GetParent()
         self.__qc = self.frame.get_qc()
         self.calc_text = self.frame.text_panel.calc_text
+        # incremental parser of calc_text
+        self.parser = Parser(self.__qc.qubits, self.frame.base)
 
         # (label, buttonid, display)
         button_collection = [
@@ -387,8 +422,13 @@ class CalcButtonPanel(wx.Panel):
         calc_string = str(self.calc_text.GetValue())
         self.button['='].Disable()
         if self.frame.busy is False:
-            seq = self.__qc.get_seq(calc_string, self.frame.base)
-            if seq:
+            if (self.parser.qubits, self.parser.base) != (self.__qc.qubits,
+                                                          self.frame.base):
+                self.parser = Parser(self.__qc.qubits, self.frame.base)
+            self.parser.feed(calc_string)
+            if self.parser.error is not None:
+                self.frame.SetStatusText(str(self.parser.error))
+            elif self.parser.complete:
                 self.button['='].Enable()
 
     def _calc(self):
@@ -396,17 +436,25 @@ class CalcButtonPanel(wx.Panel):
         self.frame.busy = True
         self.button['='].Disable()
 
-        # exec and draw job status
-        qc_result = self.__qc.exec_calc(str(self.calc_text.GetValue()),
-                                        self.frame.base)
-        self._draw(qc_result)
+        # show phases of the job on the status bar
+        self.__qc.listener = self._draw_phase
+
+        # exec and draw job status (the parsed form of check_calctext)
+        try:
+            expression = self.parser.feed(
+                str(self.calc_text.GetValue())).result()
+        except ParseError as ex:
+            expression = str(self.calc_text.GetValue())
+            self.frame.SetStatusText(str(ex))
+        future = self.__qc.submit(expression, self.frame.base)
+        self._draw(['Wait. Calculating on {0}'.format(self.__qc.backend),
+                    '...'])
 
         # init flag reset
         self.frame.init = True
 
-        # wait for result of qc
-        wait_th = threading.Thread(name='wait_th', target=self._wait_anser)
-        wait_th.start()
+        # draw the answer when the job is done
+        future.add_done_callback(self._done_anser)
 
     def _draw(self, qc_result):
         '''
@@ -420,14 +468,16 @@ class CalcButtonPanel(wx.Panel):
             wx.CallAfter(self.show_alart, 'Anser', str(ans))
         wx.CallAfter(self.calc_text.SetValue, str(ans))
 
-    def _wait_anser(self):
-        while True:
-            time.sleep(0.5)
-            wx.CallAfter(self.frame.SetStatusText,
-                         'Phase {0} {1}'
-                         .format(self.__qc.phase[-1][0], self.__qc.phase[-1][1]))
-            if self.__qc.wait is False:
-                self._draw(self.__qc.last)
-                wx.CallAfter(self.button['='].Enable)
-                self.frame.busy = False
-                break
+    def _draw_phase(self, phasename, text):
+        wx.CallAfter(self.frame.SetStatusText,
+                     'Phase {0} {1}'.format(phasename, text))
+
+    def _done_anser(self, future):
+        self.__qc.listener = None
+        try:
+            qc_result = future.result()
+        except Exception as ex:  # pylint: disable=broad-except
+            qc_result = ['FAIL: {}'.format(ex), None]
+        self._draw(qc_result)
+        wx.CallAfter(self.button['='].Enable)
+        self.frame.busy = False
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libcache
+Author: Hideto Manjo
+Licence: Apache License 2.0
+'''
+
+import os
+import mmap
+import json
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class LRUCache():
+    '''
+    bounded least recently used cache
+    '''
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def get(self, key, default=None):
+        '''
+        get value and mark it as recently used
+        '''
+        with self.__lock:
+            if key not in self.__data:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.__data.move_to_end(key)
+            return self.__data[key]
+
+    def put(self, key, value):
+        '''
+        put value, the least recently used one is dropped when full
+        '''
+        if self.maxsize <= 0:
+            return
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        '''
+        clear
+        '''
+        with self.__lock:
+            self.__data.clear()
+
+
+class TTLCache():
+    '''
+    cache of values loaded by a function, every entry has its own time
+    to live. An expired entry is returned stale while a background thread
+    loads it again (stale-while-revalidate), only a missing entry blocks
+    the caller. Errors of the background load keep the stale value.
+    '''
+    def __init__(self, ttl=60.0):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.errors = 0
+        # key -> [value, expires, loader]
+        self.__data = {}
+        self.__pending = set()
+        self.__lock = threading.Lock()
+        self.__queue = queue.Queue()
+        self.__thread = None
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def get(self, key, loader, ttl=None):
+        '''
+        value of key, loader() on a miss (blocks) or in the background
+        when the entry has expired (returns the stale value)
+        '''
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is not None:
+                entry[2] = (loader, ttl)
+                if entry[1] > time.monotonic():
+                    self.hits += 1
+                else:
+                    self.stale += 1
+                    self._revalidate(key)
+                return entry[0]
+            self.misses += 1
+        value = loader()
+        self.put(key, value, loader, ttl)
+        return value
+
+    def put(self, key, value, loader=None, ttl=None):
+        '''
+        put value of key for ttl seconds (default self.ttl)
+        '''
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self.__lock:
+            self.__data[key] = [value, expires, (loader, ttl)]
+
+    def invalidate(self, key=None):
+        '''
+        drop key, or every entry if key is None
+        '''
+        with self.__lock:
+            if key is None:
+                self.__data.clear()
+            else:
+                self.__data.pop(key, None)
+
+    def _revalidate(self, key):
+        '''
+        queue key for the refresher thread (called under the lock)
+        '''
+        if key in self.__pending or self.__data[key][2][0] is None:
+            return
+        self.__pending.add(key)
+        self.__queue.put(key)
+        if self.__thread is None:
+            self.__thread = threading.Thread(name='ttlcache_refresher',
+                                             target=self._refresher,
+                                             daemon=True)
+            self.__thread.start()
+
+    def _refresher(self):
+        while True:
+            key = self.__queue.get()
+            with self.__lock:
+                entry = self.__data.get(key)
+            try:
+                if entry is not None:
+                    (loader, ttl) = entry[2]
+                    self.put(key, loader(), loader, ttl)
+            except Exception:  # pylint: disable=broad-except
+                self.errors += 1
+            finally:
+                with self.__lock:
+                    self.__pending.discard(key)
+
+
+def content_hash(*parts):
+    '''
+    sha256 hex digest of the string forms of parts
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class DiskStore():
+    '''
+    JSON store in a local directory, one file per key. Files are written
+    atomically (temporary file + rename) so that several processes can
+    share the directory, and read through mmap.
+    '''
+    def __init__(self, directory, suffix='.json'):
+        self.directory = directory
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key, default=None):
+        '''
+        load value of key, default if missing or unreadable
+        '''
+        try:
+            with open(self._path(key), 'rb') as fp:
+                with mmap.mmap(fp.fileno(), 0,
+                               access=mmap.ACCESS_READ) as data:
+                    value = json.loads(data.read().decode('utf-8'))
+        except (OSError, ValueError):
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''
+        store value of key, returns False if value is not JSON serializable
+        or the directory is not writable
+        '''
+        try:
+            data = json.dumps(value).encode('utf-8')
+        except (TypeError, ValueError):
+            return False
+
+        try:
+            (fd, tmppath) = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(tmppath, self._path(key))
+        except OSError:
+            if os.path.exists(tmppath):
+                os.remove(tmppath)
+            return False
+        return True
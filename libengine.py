@@ -0,0 +1,464 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libengine
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Gate list representation of the calculator circuits and local engines
+that evaluate it without QISKit.
+'''
+
+import random
+
+
+class EngineError(Exception):
+    '''
+    raised when a gate list can not be evaluated by an engine
+    '''
+    pass
+
+
+class Register():
+    '''
+    register of a GateList, q_r[i] returns the flat bit index
+    '''
+    def __init__(self, name, offset, size):
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.size:
+            raise IndexError('register {0} has {1} bits'
+                             .format(self.name, self.size))
+        return self.offset + index
+
+
+class GateList():
+    '''
+    minimal circuit which records gates as tuples (name, *bits).
+    It accepts the same calls as a QISKit circuit (x, h, cx, ccx, reset,
+    measure, barrier), so the same builder functions can write into both.
+    '''
+    def __init__(self, name='qcirc'):
+        self.name = name
+        self.qregs = []
+        self.cregs = []
+        self.num_qubits = 0
+        self.num_clbits = 0
+        self.gates = []
+
+    def add_qreg(self, name, size):
+        '''
+        add quantum register
+        '''
+        register = Register(name, self.num_qubits, size)
+        self.qregs.append(register)
+        self.num_qubits += size
+        return register
+
+    def add_creg(self, name, size):
+        '''
+        add classical register
+        '''
+        register = Register(name, self.num_clbits, size)
+        self.cregs.append(register)
+        self.num_clbits += size
+        return register
+
+    def x(self, qubit):
+        '''
+        x gate
+        '''
+        self.gates.append(('x', qubit))
+
+    def h(self, qubit):
+        '''
+        h gate
+        '''
+        self.gates.append(('h', qubit))
+
+    def cx(self, ctl, tgt):
+        '''
+        cx gate
+        '''
+        self.gates.append(('cx', ctl, tgt))
+
+    def ccx(self, ctl1, ctl2, tgt):
+        '''
+        ccx gate
+        '''
+        self.gates.append(('ccx', ctl1, ctl2, tgt))
+
+    def reset(self, qubit):
+        '''
+        reset qubit or whole register
+        '''
+        if isinstance(qubit, Register):
+            for i in range(qubit.size):
+                self.gates.append(('reset', qubit[i]))
+        else:
+            self.gates.append(('reset', qubit))
+
+    def measure(self, qubit, cbit):
+        '''
+        measure qubit into classical bit
+        '''
+        self.gates.append(('measure', qubit, cbit))
+
+    def barrier(self):
+        '''
+        barrier
+        '''
+        self.gates.append(('barrier',))
+
+    def extend(self, other):
+        '''
+        append gates of other gate list
+        '''
+        self.gates.extend(other.gates)
+        return self
+
+    def reverse(self):
+        '''
+        reverse gate order (inverse for self-inverse gates)
+        '''
+        self.gates.reverse()
+        return self
+
+    def copy(self, name=None):
+        '''
+        copy
+        '''
+        circuit = GateList(self.name if name is None else name)
+        circuit.qregs = list(self.qregs)
+        circuit.cregs = list(self.cregs)
+        circuit.num_qubits = self.num_qubits
+        circuit.num_clbits = self.num_clbits
+        circuit.gates = list(self.gates)
+        return circuit
+
+
+def format_clbits(clbits, num_clbits):
+    '''
+    classical bits -> count key as QISKit prints it (highest bit first)
+    '''
+    return format(clbits, '0{}b'.format(num_clbits))
+
+
+def run_classical(circuit, state=0):
+    '''
+    evaluate a gate list made of x, cx, ccx, reset, measure and barrier
+    on an integer bit vector. This is exact because these gates only
+    permute basis states. returns (state, clbits).
+    '''
+    clbits = 0
+    for gate in circuit.gates:
+        name = gate[0]
+        if name == 'cx':
+            if state >> gate[1] & 1:
+                state ^= 1 << gate[2]
+        elif name == 'ccx':
+            if state >> gate[1] & state >> gate[2] & 1:
+                state ^= 1 << gate[3]
+        elif name == 'x':
+            state ^= 1 << gate[1]
+        elif name == 'reset':
+            state &= ~(1 << gate[1])
+        elif name == 'measure':
+            bit = state >> gate[1] & 1
+            clbits = (clbits & ~(1 << gate[2])) | (bit << gate[2])
+        elif name != 'barrier':
+            raise EngineError('{} gate is not supported by the classical '
+                              'engine'.format(name))
+    return (state, clbits)
+
+
+def run_branches(circuit, max_qubits=64):
+    '''
+    evaluate a gate list with H inputs as an array of basis states (one
+    element per branch of the superposition), applying every gate as a
+    vectorized bitwise operation on the whole array. This is exact as
+    long as an H never acts on a qubit which may already be superposed,
+    i.e. the circuit after the input H gates is a permutation.
+    returns counts {clbits key: number of branches}.
+    '''
+    import numpy as np
+
+    if circuit.num_qubits > max_qubits:
+        raise EngineError('{0} qubits do not fit the {1} bit branch state'
+                          .format(circuit.num_qubits, max_qubits))
+
+    states = np.zeros(1, dtype=np.uint64)
+    clbits = np.zeros(1, dtype=np.uint64)
+    mixed = set()
+    for gate in circuit.gates:
+        name = gate[0]
+        if name == 'cx':
+            states ^= ((states >> gate[1]) & 1) << gate[2]
+            if gate[1] in mixed:
+                mixed.add(gate[2])
+        elif name == 'ccx':
+            states ^= ((states >> gate[1]) & (states >> gate[2]) & 1) \
+                << gate[3]
+            if gate[1] in mixed or gate[2] in mixed:
+                mixed.add(gate[3])
+        elif name == 'x':
+            states ^= np.uint64(1 << gate[1])
+        elif name == 'h':
+            if gate[1] in mixed:
+                raise EngineError('h gate on superposed qubit {} can '
+                                  'interfere'.format(gate[1]))
+            mask = np.uint64(1 << gate[1])
+            states = np.concatenate((states & ~mask, states | mask))
+            clbits = np.concatenate((clbits, clbits))
+            mixed.add(gate[1])
+        elif name == 'reset':
+            states &= ~np.uint64(1 << gate[1])
+            mixed.discard(gate[1])
+        elif name == 'measure':
+            mask = np.uint64(1 << gate[2])
+            clbits = (clbits & ~mask) | (((states >> gate[1]) & 1)
+                                         << gate[2])
+        elif name != 'barrier':
+            raise EngineError('{} gate is not supported by the branch '
+                              'engine'.format(name))
+
+    (keys, counts) = np.unique(clbits, return_counts=True)
+    return {format_clbits(int(key), circuit.num_clbits): int(count)
+            for (key, count) in zip(keys, counts)}
+
+
+SELF_INVERSE_GATES = ('x', 'h', 'cx', 'ccx')
+
+
+def describe_gate(gate):
+    '''
+    (name, qubits) of a GateList gate for optimize_gates
+    '''
+    name = gate[0]
+    if name == 'measure':
+        return (name, (gate[1],))
+    if name == 'barrier':
+        return (name, None)
+    return (name, gate[1:])
+
+
+def _propagate(gates, describe):
+    '''
+    drop gates which are identities on known basis values:
+    cx/ccx with a control known to be |0> and reset of a qubit known to
+    be |0>. Qubits start in |0>, H and unknown gates make them unknown.
+    '''
+    values = {}
+    optimized = []
+    for gate in gates:
+        (name, qubits) = describe(gate)
+        if qubits is None:
+            optimized.append(gate)
+            continue
+        current = [values.get(qubit, 0) for qubit in qubits]
+        if name in ('cx', 'ccx'):
+            controls = current[:-1]
+            if 0 in controls:
+                continue
+            if None in controls:
+                values[qubits[-1]] = None
+            elif current[-1] is not None:
+                values[qubits[-1]] = 1 - current[-1]
+        elif name == 'x':
+            if current[0] is not None:
+                values[qubits[0]] = 1 - current[0]
+        elif name == 'reset':
+            if current[0] == 0:
+                continue
+            values[qubits[0]] = 0
+        elif name != 'measure':
+            for qubit in qubits:
+                values[qubit] = None
+        optimized.append(gate)
+    return optimized
+
+
+def _cancel(gates, describe):
+    '''
+    cancel adjacent pairs of the same self-inverse gate on the same qubits
+    '''
+    optimized = []
+    last = {}   # qubit -> stack of indices of optimized
+    for gate in gates:
+        (name, qubits) = describe(gate)
+        if qubits is None:
+            last = {}
+            optimized.append(gate)
+            continue
+
+        stacks = [last.get(qubit) for qubit in qubits]
+        if name in SELF_INVERSE_GATES and all(stacks):
+            index = stacks[0][-1]
+            (prev_name, prev_qubits) = describe(optimized[index])
+            if (prev_name == name and
+                    all(stack[-1] == index for stack in stacks) and
+                    sorted(prev_qubits[:-1]) == sorted(qubits[:-1]) and
+                    prev_qubits[-1] == qubits[-1]):
+                optimized[index] = None
+                for stack in stacks:
+                    stack.pop()
+                continue
+
+        optimized.append(gate)
+        for qubit in qubits:
+            last.setdefault(qubit, []).append(len(optimized) - 1)
+    return [gate for gate in optimized if gate is not None]
+
+
+def circuit_depth(gates, describe):
+    '''
+    depth of a gate sequence (barriers align all qubits)
+    '''
+    levels = {}
+    depth = 0
+    for gate in gates:
+        (_name, qubits) = describe(gate)
+        if qubits is None:
+            levels = dict.fromkeys(levels, depth)
+            continue
+        level = max(levels.get(qubit, 0) for qubit in qubits) + 1
+        for qubit in qubits:
+            levels[qubit] = level
+        depth = max(depth, level)
+    return depth
+
+
+def optimize_gates(gates, describe=describe_gate, max_passes=8):
+    '''
+    peephole optimization: drop identity gates on known basis values and
+    redundant resets, cancel adjacent self-inverse gate pairs.
+    describe(gate) -> (name, qubits) with controls first and the target
+    last, qubits None for a barrier on all qubits.
+    returns (optimized gates, stats).
+    '''
+    stats = {'gates_before': len(gates),
+             'depth_before': circuit_depth(gates, describe)}
+    optimized = list(gates)
+    for _ in range(max_passes):
+        count = len(optimized)
+        optimized = _cancel(_propagate(optimized, describe), describe)
+        if len(optimized) == count:
+            break
+    stats['gates_after'] = len(optimized)
+    stats['depth_after'] = circuit_depth(optimized, describe)
+    return (optimized, stats)
+
+
+def _split(component, qubit, eps):
+    '''
+    split (weight, clbits, keys, amps) by the value of qubit,
+    returns [(value, weight, clbits, keys, amps)] with normalized amps
+    '''
+    (weight, clbits, keys, amps) = component
+    ones = ((keys >> qubit) & 1).astype(bool)
+    splitted = []
+    for (value, select) in enumerate((~ones, ones)):
+        part = amps[select]
+        prob = float((part.real**2 + part.imag**2).sum())
+        if prob <= eps:
+            continue
+        splitted.append((value, weight * prob, clbits, keys[select],
+                         part / prob**0.5))
+    return splitted
+
+
+def _merge(np, keys, amps, eps):
+    '''
+    sum amplitudes of equal keys and drop zeros
+    '''
+    (keys, inverse) = np.unique(keys, return_inverse=True)
+    amps = (np.bincount(inverse, amps.real, len(keys)) +
+            1j * np.bincount(inverse, amps.imag, len(keys)))
+    select = np.abs(amps) > eps
+    return (keys[select], amps[select])
+
+
+def run_sparse(circuit, eps=1e-12, max_qubits=64):
+    '''
+    sparse statevector simulation of a gate list with x, h, cx, ccx,
+    reset, measure and barrier. Only nonzero amplitudes are stored, as
+    index (uint64) and amplitude (complex) arrays; x, cx and ccx permute
+    the indices, h and reset merge equal indices. reset and
+    measure split the state into an ensemble of
+    (weight, clbits, indices, amplitudes) components.
+    returns exact probabilities {clbits key: probability}.
+    '''
+    # pylint: disable=too-many-branches,too-many-locals
+    import numpy as np
+
+    if circuit.num_qubits > max_qubits:
+        raise EngineError('{0} qubits do not fit the {1} bit index'
+                          .format(circuit.num_qubits, max_qubits))
+
+    sqrt1_2 = 0.5 ** 0.5
+    components = [(1.0, 0, np.zeros(1, dtype=np.uint64),
+                   np.ones(1, dtype=complex))]
+    for gate in circuit.gates:
+        name = gate[0]
+        if name == 'barrier':
+            continue
+        if name in ('reset', 'measure'):
+            splitted = []
+            for component in components:
+                for (value, weight, clbits, keys, amps) in _split(
+                        component, gate[1], eps):
+                    if name == 'reset' and value == 1:
+                        (keys, amps) = _merge(
+                            np, keys ^ np.uint64(1 << gate[1]), amps, eps)
+                    elif name == 'measure':
+                        mask = 1 << gate[2]
+                        clbits = (clbits & ~mask) | (value << gate[2])
+                    splitted.append((weight, clbits, keys, amps))
+            components = splitted
+            continue
+
+        updated = []
+        for (weight, clbits, keys, amps) in components:
+            if name == 'x':
+                keys = keys ^ np.uint64(1 << gate[1])
+            elif name == 'cx':
+                keys = keys ^ (((keys >> gate[1]) & 1) << gate[2])
+            elif name == 'ccx':
+                keys = keys ^ (((keys >> gate[1]) & (keys >> gate[2]) & 1)
+                               << gate[3])
+            elif name == 'h':
+                mask = np.uint64(1 << gate[1])
+                sign = 1 - 2 * ((keys >> gate[1]) & 1).astype(float)
+                keys = np.concatenate((keys & ~mask, keys | mask))
+                amps = np.concatenate((amps, amps * sign)) * sqrt1_2
+                (keys, amps) = _merge(np, keys, amps, eps)
+            else:
+                raise EngineError('{} gate is not supported by the sparse '
+                                  'simulator'.format(name))
+            updated.append((weight, clbits, keys, amps))
+        components = updated
+
+    probabilities = {}
+    for (weight, clbits, _keys, _amps) in components:
+        key = format_clbits(clbits, circuit.num_clbits)
+        probabilities[key] = probabilities.get(key, 0.0) + weight
+    return probabilities
+
+
+def sample_counts(probabilities, shots, seed=1):
+    '''
+    sample shots from probabilities, returns counts {key: count}
+    '''
+    keys = sorted(probabilities)
+    rng = random.Random(seed)
+    counts = {}
+    for key in rng.choices(keys, [probabilities[key] for key in keys],
+                           k=shots):
+        counts[key] = counts.get(key, 0) + 1
+    return counts
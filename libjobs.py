@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libjobs
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Durable submission queue for remote jobs. A job is written to a SQLite
+database before it is submitted and its job id as soon as the API returns
+it, so the jobs in flight are reattached after a restart. Submissions are
+rate limited and transient API errors are retried with exponential backoff.
+
+The API is any object with run_job(qasms, backend, shots, max_credits)
+and get_job(job_id) of IBMQuantumExperience (or a fake of it).
+'''
+
+import json
+import time
+import random
+import sqlite3
+import threading
+
+from libcache import content_hash
+
+# errors of the API worth a retry (requests errors are IOError)
+TRANSIENT_ERRORS = (OSError,)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    circuit_hash TEXT NOT NULL,
+    backend TEXT NOT NULL,
+    request TEXT NOT NULL,
+    status TEXT NOT NULL,
+    job_id TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_try REAL NOT NULL DEFAULT 0,
+    response TEXT,
+    delivered INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+)
+'''
+
+
+class JobError(Exception):
+    '''
+    job failed on the server or retries are used up
+    '''
+
+
+def qobj_request(qobj):
+    '''
+    run_job arguments of a compiled QISKit qobj
+    '''
+    config = qobj['config']
+    return {'names': [circuit['name'] for circuit in qobj['circuits']],
+            'qasms': [{'qasm': circuit['compiled_circuit_qasm']}
+                      for circuit in qobj['circuits']],
+            'backend': config['backend'],
+            'shots': config['shots'],
+            'max_credits': config.get('max_credits', 10)}
+
+
+class JobResult():
+    '''
+    finished job in the shape of a QISKit Result
+    (get_data, get_job_id, str)
+    '''
+    def __init__(self, job_id, names, job):
+        self.__job_id = job_id
+        self.__names = names
+        self.__job = job
+
+    def __str__(self):
+        return str(self.__job.get('status', 'COMPLETED'))
+
+    def get_job_id(self):
+        '''
+        job id of the server
+        '''
+        return self.__job_id
+
+    def get_data(self, name):
+        '''
+        data (counts, time) of circuit name
+        '''
+        item = self.__job['qasms'][self.__names.index(name)]
+        return item.get('result', item)['data']
+
+
+class JobQueue():
+    '''
+    durable job queue, one worker thread submits queued jobs (at most
+    rate per minute) and polls running ones every poll seconds.
+    status of a job: queued -> running -> done or failed
+    '''
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, api, path='jobs.sqlite', rate=6.0, retries=5,
+                 backoff=2.0, backoff_max=120.0, poll=5.0):
+        # pylint: disable=too-many-arguments
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.api = api
+        self.path = path
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.poll = poll
+        self.__db = sqlite3.connect(path, check_same_thread=False,
+                                    isolation_level=None)
+        self.__db.row_factory = sqlite3.Row
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute(SCHEMA)
+        columns = [row['name'] for row in
+                   self.__db.execute('PRAGMA table_info(jobs)')]
+        if 'delivered' not in columns:
+            # databases of earlier versions, their results were returned
+            self.__db.execute('ALTER TABLE jobs ADD COLUMN delivered '
+                              'INTEGER NOT NULL DEFAULT 1')
+        self.__lock = threading.Lock()
+        self.__changed = threading.Condition(self.__lock)
+        self.__next_submit = 0.0
+        self.__closed = False
+
+        # reattach: unfinished jobs of an earlier process are due now
+        with self.__lock:
+            self.__db.execute("UPDATE jobs SET next_try = 0 "
+                              "WHERE status IN ('queued', 'running')")
+        self.__thread = threading.Thread(name='qc_jobs', target=self._loop,
+                                         daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    def close(self):
+        '''
+        stop the worker thread, unfinished jobs stay in the database
+        '''
+        with self.__changed:
+            self.__closed = True
+            self.__changed.notify_all()
+        self.__thread.join()
+        self.__db.close()
+
+    def submit(self, request):
+        '''
+        queue request (qobj_request) and return the local job number.
+        An unfinished job of the same circuits, or a finished one whose
+        result was not returned yet (reattached after a restart), is
+        reused.
+        '''
+        circuit_hash = content_hash(request['qasms'], request['backend'],
+                                    request['shots'])
+        now = time.time()
+        with self.__changed:
+            row = self.__db.execute(
+                "SELECT id FROM jobs WHERE circuit_hash = ? "
+                "AND (status IN ('queued', 'running') "
+                "OR (status = 'done' AND delivered = 0)) ORDER BY id DESC",
+                (circuit_hash,)).fetchone()
+            if row is not None:
+                return row['id']
+            cursor = self.__db.execute(
+                "INSERT INTO jobs (circuit_hash, backend, request, status, "
+                "delivered, created, updated) "
+                "VALUES (?, ?, ?, 'queued', 0, ?, ?)",
+                (circuit_hash, request['backend'], json.dumps(request),
+                 now, now))
+            self.__changed.notify_all()
+            return cursor.lastrowid
+
+    def job(self, number):
+        '''
+        row of the local job number as dict, None if unknown
+        '''
+        with self.__lock:
+            row = self.__db.execute("SELECT * FROM jobs WHERE id = ?",
+                                    (number,)).fetchone()
+        return None if row is None else dict(row)
+
+    def unfinished(self):
+        '''
+        rows of the queued and running jobs
+        '''
+        with self.__lock:
+            return [dict(row) for row in self.__db.execute(
+                "SELECT * FROM jobs WHERE status IN ('queued', 'running') "
+                "ORDER BY id")]
+
+    def wait(self, number, timeout=None):
+        '''
+        wait for the local job number, returns JobResult,
+        raises JobError if it failed and TimeoutError on timeout
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__changed:
+            while True:
+                row = self.__db.execute("SELECT * FROM jobs WHERE id = ?",
+                                        (number,)).fetchone()
+                if row is None:
+                    raise JobError('unknown job {}'.format(number))
+                if row['status'] == 'done':
+                    self.__db.execute("UPDATE jobs SET delivered = 1 "
+                                      "WHERE id = ?", (number,))
+                    request = json.loads(row['request'])
+                    return JobResult(row['job_id'], request['names'],
+                                     json.loads(row['response']))
+                if row['status'] == 'failed':
+                    raise JobError('job {0} failed: {1}'
+                                   .format(row['job_id'] or number,
+                                           row['error']))
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError('job {} is still {}'
+                                           .format(number, row['status']))
+                self.__changed.wait(remaining)
+
+    def run_qobj(self, qobj, timeout=None):
+        '''
+        submit a compiled qobj and wait for its JobResult
+        '''
+        return self.wait(self.submit(qobj_request(qobj)), timeout)
+
+    def _update(self, number, **values):
+        '''
+        update columns of a job and wake up the waiters
+        '''
+        values['updated'] = time.time()
+        columns = ', '.join('{} = ?'.format(key) for key in values)
+        with self.__changed:
+            self.__db.execute('UPDATE jobs SET {} WHERE id = ?'
+                              .format(columns),
+                              list(values.values()) + [number])
+            self.__changed.notify_all()
+
+    def _retry(self, row, ex):
+        '''
+        schedule the next try of row after a transient error
+        '''
+        attempts = row['attempts'] + 1
+        if attempts > self.retries:
+            self._update(row['id'], status='failed', attempts=attempts,
+                         error='{0} (after {1} attempts)'.format(ex,
+                                                                 attempts))
+            return
+        delay = min(self.backoff * 2**(attempts - 1), self.backoff_max)
+        self._update(row['id'], attempts=attempts, error=str(ex),
+                     next_try=time.time() + random.uniform(0.5, 1.0) * delay)
+
+    def _fail(self, row, ex):
+        '''
+        mark row failed after an error that is not worth a retry
+        '''
+        self._update(row['id'], status='failed',
+                     error='{0}: {1}'.format(type(ex).__name__, ex))
+
+    def _submit(self, row):
+        request = json.loads(row['request'])
+        try:
+            response = self.api.run_job(request['qasms'], request['backend'],
+                                        shots=request['shots'],
+                                        max_credits=request['max_credits'])
+        except TRANSIENT_ERRORS as ex:
+            self._retry(row, ex)
+            return
+        except Exception as ex:  # pylint: disable=broad-except
+            # API errors of IBMQuantumExperience are plain Exceptions
+            self._fail(row, ex)
+            return
+        if 'id' not in response:
+            self._update(row['id'], status='failed',
+                         error=str(response.get('error', response)))
+            return
+        self._update(row['id'], status='running', job_id=response['id'],
+                     attempts=0, next_try=time.time() + self.poll)
+
+    def _check(self, row):
+        try:
+            job = self.api.get_job(row['job_id'])
+        except TRANSIENT_ERRORS as ex:
+            self._retry(row, ex)
+            return
+        except Exception as ex:  # pylint: disable=broad-except
+            self._fail(row, ex)
+            return
+        status = str(job.get('status', ''))
+        if status == 'COMPLETED':
+            self._update(row['id'], status='done', response=json.dumps(job))
+        elif status.startswith('ERROR') or status == 'CANCELLED' or \
+                'error' in job:
+            self._update(row['id'], status='failed',
+                         error=str(job.get('error', status)))
+        else:
+            self._update(row['id'], attempts=0,
+                         next_try=time.time() + self.poll)
+
+    def _loop(self):
+        while True:
+            with self.__changed:
+                if self.__closed:
+                    return
+                rows = self.__db.execute(
+                    "SELECT * FROM jobs WHERE status IN ('queued', 'running')"
+                    " AND next_try <= ? ORDER BY id",
+                    (time.time(),)).fetchall()
+
+            for row in rows:
+                try:
+                    if row['status'] == 'running':
+                        self._check(row)
+                    elif time.monotonic() >= self.__next_submit:
+                        self.__next_submit = (time.monotonic() +
+                                              60.0 / self.rate)
+                        self._submit(row)
+                except Exception as ex:  # pylint: disable=broad-except
+                    # keep the worker alive, waiters get a JobError
+                    self._fail(row, ex)
+
+            with self.__changed:
+                if not self.__closed:
+                    self.__changed.wait(min(self.poll, 0.5))
@@ -0,0 +1,300 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libmetrics
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Timed phase spans (monotonic clock) and counters of a QC, exported as a
+JSON snapshot or in the Prometheus text format, and per-call profiles.
+'''
+
+import io
+import os
+import re
+import json
+import time
+import logging
+import pstats
+import cProfile
+import tracemalloc
+import threading
+import contextlib
+from collections import deque
+
+# counter -> help text (Prometheus HELP)
+COUNTERS = {
+    'calculations': 'Calculations started',
+    'gates': 'Gates of the defined circuits',
+    'shots': 'Shots run or sampled',
+    'cache_hits': 'Compiled circuit memory cache hits',
+    'cache_misses': 'Compiled circuit memory cache misses',
+    'store_hits': 'Compiled circuit disk store hits',
+    'store_misses': 'Compiled circuit disk store misses',
+    'result_hits': 'Result cache hits (expressions without H)',
+    'result_misses': 'Result cache misses (expressions without H)',
+    'job_wait_seconds': 'Seconds spent waiting for backend jobs',
+}
+
+# profile_call: calls in progress and whether they started tracemalloc
+_TRACING = {'calls': 0, 'started': False}
+_TRACING_LOCK = threading.Lock()
+# held by the profiled call running cProfile, only one profiler can be
+# active at a time since Python 3.12
+_PROFILE_LOCK = threading.Lock()
+
+# gauge -> help text
+GAUGES = {
+    'circuit_gates': 'Gates of the last defined circuit',
+    'circuit_depth': 'Depth of the last defined circuit',
+}
+
+
+class Metrics():
+    '''
+    phase spans and counters, thread safe. A phase span of a thread runs
+    until the next phase of the thread starts or end() is called.
+    '''
+    def __init__(self, max_spans=256):
+        self.started = time.monotonic()
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__spans = deque(maxlen=max_spans)
+        self.__phases = {}
+        self.__counters = dict.fromkeys(COUNTERS, 0)
+        self.__gauges = dict.fromkeys(GAUGES, 0)
+
+    def phase(self, name, text=''):
+        '''
+        end the running span of this thread and start phase name
+        '''
+        now = time.monotonic()
+        self._end(now)
+        self.__local.span = (str(name), str(text), now)
+
+    def end(self):
+        '''
+        end the running span of this thread
+        '''
+        self._end(time.monotonic())
+
+    def _end(self, now):
+        span = getattr(self.__local, 'span', None)
+        if span is None:
+            return
+        self.__local.span = None
+        (name, text, start) = span
+        seconds = now - start
+        with self.__lock:
+            self.__spans.append({'phase': name, 'text': text,
+                                 'start': start, 'end': now,
+                                 'seconds': seconds})
+            stat = self.__phases.setdefault(name, [0, 0.0, 0.0])
+            stat[0] += 1
+            stat[1] += seconds
+            stat[2] = max(stat[2], seconds)
+
+    def count(self, name, value=1):
+        '''
+        add value to counter name
+        '''
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+
+    def set(self, name, value):
+        '''
+        set gauge name
+        '''
+        with self.__lock:
+            self.__gauges[name] = value
+
+    def circuit(self, gates, depth):
+        '''
+        record size of a defined circuit
+        '''
+        self.count('gates', gates)
+        self.set('circuit_gates', gates)
+        self.set('circuit_depth', depth)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''
+        add the seconds of the with block to counter name
+        '''
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.count(name, time.monotonic() - start)
+
+    def snapshot(self):
+        '''
+        dict of counters, gauges, phase statistics and recent spans
+        '''
+        with self.__lock:
+            return {
+                'uptime_seconds': time.monotonic() - self.started,
+                'counters': dict(self.__counters),
+                'gauges': dict(self.__gauges),
+                'phases': {name: {'count': stat[0],
+                                  'seconds_total': stat[1],
+                                  'seconds_max': stat[2]}
+                           for (name, stat) in sorted(self.__phases.items())},
+                'spans': list(self.__spans),
+            }
+
+    def to_json(self, indent=None):
+        '''
+        JSON snapshot
+        '''
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def prometheus(self, prefix='qc'):
+        '''
+        Prometheus text exposition format
+        '''
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, helptext, samples):
+            lines.append('# HELP {0}_{1} {2}'.format(prefix, name, helptext))
+            lines.append('# TYPE {0}_{1} {2}'.format(prefix, name, kind))
+            for (labels, value) in samples:
+                lines.append('{0}_{1}{2} {3}'.format(prefix, name, labels,
+                                                     repr(float(value))))
+
+        metric('uptime_seconds', 'gauge', 'Seconds since start',
+               [('', snapshot['uptime_seconds'])])
+        for (name, helptext) in COUNTERS.items():
+            metric(name + '_total', 'counter', helptext,
+                   [('', snapshot['counters'].get(name, 0))])
+        for (name, helptext) in GAUGES.items():
+            metric(name, 'gauge', helptext,
+                   [('', snapshot['gauges'].get(name, 0))])
+
+        phases = snapshot['phases']
+        for (name, key, kind, helptext) in (
+                ('phase_seconds_total', 'seconds_total', 'counter',
+                 'Seconds spent in the phase'),
+                ('phase_spans_total', 'count', 'counter',
+                 'Spans of the phase'),
+                ('phase_seconds_max', 'seconds_max', 'gauge',
+                 'Longest span of the phase')):
+            metric(name, kind, helptext,
+                   [('{{phase="{0}"}}'.format(phase), stat[key])
+                    for (phase, stat) in phases.items()])
+        return '\n'.join(lines) + '\n'
+
+
+def _slug(text):
+    '''
+    file name safe form of text
+    '''
+    return re.sub(r'[^0-9A-Za-z+.=-]+', '_', str(text))[:64]
+
+
+def _trace_start():
+    '''
+    start tracemalloc for a profiled call (shared by concurrent calls)
+    '''
+    with _TRACING_LOCK:
+        if _TRACING['calls'] == 0:
+            _TRACING['started'] = not tracemalloc.is_tracing()
+            if _TRACING['started']:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        _TRACING['calls'] += 1
+
+
+def _trace_stop():
+    '''
+    (peak, top allocations) of a profiled call, tracemalloc stops after
+    the last concurrent call if profile_call started it
+    '''
+    with _TRACING_LOCK:
+        (_current, peak) = tracemalloc.get_traced_memory()
+        allocations = tracemalloc.take_snapshot().statistics('lineno')[:10]
+        _TRACING['calls'] -= 1
+        if _TRACING['calls'] == 0 and _TRACING['started']:
+            tracemalloc.stop()
+    return (peak, allocations)
+
+
+def _profile_start(tags):
+    '''
+    enabled cProfile.Profile of a profiled call, None if another
+    profile is active
+    '''
+    if _PROFILE_LOCK.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            return profiler
+        except ValueError:
+            # a profiler outside of profile_call (Python >= 3.12)
+            _PROFILE_LOCK.release()
+    logging.getLogger('qc').info(
+        'cProfile of %s skipped, another profile is active', tags)
+    return None
+
+
+def _write_profile(directory, tags, profiler, seconds, peak, allocations):
+    '''
+    dump profiler (.prof, None if cProfile was skipped) and the text
+    report (.txt) to directory
+    '''
+    # pylint: disable=too-many-arguments
+    os.makedirs(directory, exist_ok=True)
+    name = '_'.join([time.strftime('%Y%m%d-%H%M%S'),
+                     '{:06d}'.format(int(time.time() * 1e6) % 1000000)] +
+                    [_slug(value) for value in tags.values()])
+    path = os.path.join(directory, name)
+    if profiler is not None:
+        profiler.dump_stats(path + '.prof')
+
+    report = io.StringIO()
+    for (key, value) in tags.items():
+        report.write('{0}: {1}\n'.format(key, value))
+    report.write('seconds: {0:.6f}\n'.format(seconds))
+    report.write('peak allocation: {0} bytes\n\n'.format(peak))
+    report.write('top allocations:\n')
+    for stat in allocations:
+        report.write('  {}\n'.format(stat))
+    report.write('\n')
+    if profiler is None:
+        report.write('cProfile skipped, another profile was active\n')
+    else:
+        pstats.Stats(profiler, stream=report).sort_stats(
+            'cumulative').print_stats(30)
+    with open(path + '.txt', 'w') as fp:
+        fp.write(report.getvalue())
+
+
+def profile_call(directory, tags, func, *args, **kwargs):
+    '''
+    call func under cProfile and tracemalloc and dump the profile (.prof,
+    for pstats or snakeviz) and a text report with the peak allocation
+    to directory. The file names are tagged with the values of tags.
+    returns the return value of func, a report that cannot be written
+    is logged.
+    tracemalloc traces all threads, concurrent calls share the peak.
+    cProfile runs for one call at a time, concurrent calls (and calls
+    under another profiler) get the tracemalloc report only.
+    '''
+    _trace_start()
+    profiler = _profile_start(tags)
+    start = time.monotonic()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.monotonic() - start
+        if profiler is not None:
+            profiler.disable()
+            _PROFILE_LOCK.release()
+        (peak, allocations) = _trace_stop()
+        try:
+            _write_profile(directory, tags, profiler, seconds, peak,
+                           allocations)
+        except Exception as ex:  # pylint: disable=broad-except
+            logging.getLogger('qc').warning(
+                'profile of %s not written: %s', tags, ex)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libparse
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Incremental tokenizer and validator of expressions like "3+H-1".
+Parser keeps its state between keystrokes and validates only the appended
+characters, errors carry their position in the text. The parsed form
+(ParsedExpression) is accepted by QC.exec_calc as it is.
+'''
+
+import re
+
+OPERATORS = '+-'
+
+# characters of an operand
+OPERAND_CHARS = {'bin': re.compile(r'[01H]'), 'dec': re.compile(r'[0-9H]')}
+SPACE = re.compile(r'\s')
+
+
+class ParseError(ValueError):
+    '''
+    invalid expression, position is the index of the offending character
+    '''
+    def __init__(self, message, position):
+        super(ParseError, self).__init__(
+            '{0} at position {1}'.format(message, position))
+        self.message = message
+        self.position = position
+
+
+class ParsedExpression():
+    '''
+    validated expression: seq is the list of binary operands (qubits
+    wide, H for superposed bits) and operators as QC.get_seq returns it
+    '''
+    __slots__ = ('text', 'base', 'qubits', 'seq')
+
+    def __init__(self, text, base, qubits, seq):
+        self.text = text
+        self.base = base
+        self.qubits = qubits
+        self.seq = tuple(seq)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return 'ParsedExpression({0!r}, {1!r}, {2})'.format(
+            self.text, self.base, self.qubits)
+
+
+class Parser():
+    '''
+    incremental parser of qubits wide operands in base (dec or bin).
+    feed() the whole text after every change: an appended suffix is
+    validated on its own, other edits parse the text again.
+    '''
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, qubits=3, base='dec'):
+        if base not in OPERAND_CHARS:
+            raise ValueError('base must be dec or bin')
+        self.qubits = qubits
+        self.base = base
+        self.__chars = OPERAND_CHARS[base]
+        self.reset()
+
+    def reset(self):
+        '''
+        forget the text
+        '''
+        self.text = ''
+        self.error = None
+        self.__seq = []
+        self.__operand = ''
+        self.__start = 0
+        self.__closed = False
+
+    def feed(self, text):
+        '''
+        parse text (incrementally if it extends the last text),
+        returns self
+        '''
+        if not text.startswith(self.text):
+            self.reset()
+        for (position, char) in enumerate(text[len(self.text):],
+                                          len(self.text)):
+            if self.error is not None:
+                break
+            self._step(char, position)
+        self.text = text
+        return self
+
+    @property
+    def complete(self):
+        '''
+        True if the text is a valid expression
+        '''
+        return self.error is None and self._check() is None
+
+    def result(self):
+        '''
+        ParsedExpression of the text, raises ParseError
+        '''
+        if self.error is not None:
+            raise self.error
+        error = self._check()
+        if error is not None:
+            raise error
+        seq = self.__seq + [self._binary(self.__operand)]
+        return ParsedExpression(self.text, self.base, self.qubits, seq)
+
+    def _check(self):
+        '''
+        ParseError of an incomplete text (missing operand or operator),
+        None if complete
+        '''
+        if self.__operand == '':
+            if self.__seq == []:
+                return ParseError('empty expression', len(self.text))
+            return ParseError('missing operand', len(self.text))
+        if self.__seq == []:
+            return ParseError('missing operator', len(self.text))
+        if self.base == 'bin' and len(self.__operand) != self.qubits:
+            return ParseError('operand needs {} bits'.format(self.qubits),
+                              self.__start)
+        return None
+
+    def _binary(self, operand):
+        '''
+        qubits wide binary form of a valid operand
+        '''
+        if self.base == 'bin':
+            return operand
+        if operand == 'H':
+            return 'H' * self.qubits
+        return format(int(operand), '0{}b'.format(self.qubits))
+
+    def _step(self, char, position):
+        '''
+        validate one appended character
+        '''
+        if char in OPERATORS:
+            if self.__operand == '':
+                self.error = ParseError('missing operand before '
+                                        '{!r}'.format(char), position)
+                return
+            if self.base == 'bin' and len(self.__operand) != self.qubits:
+                self.error = ParseError('operand needs {} bits'
+                                        .format(self.qubits), self.__start)
+                return
+            self.__seq.extend([self._binary(self.__operand), char])
+            self.__operand = ''
+            self.__closed = False
+            return
+
+        if SPACE.match(char):
+            self.__closed = self.__operand != ''
+            return
+
+        if self.__chars.match(char) is None:
+            self.error = ParseError('unexpected {!r}'.format(char), position)
+            return
+        if self.__closed:
+            self.error = ParseError('missing operator', position)
+            return
+
+        if self.__operand == '':
+            self.__start = position
+        operand = self.__operand + char
+        if self.base == 'bin':
+            if len(operand) > self.qubits:
+                self.error = ParseError('operand needs {} bits'
+                                        .format(self.qubits), self.__start)
+                return
+        elif 'H' in operand and operand != 'H':
+            self.error = ParseError('H must be a whole operand', position)
+            return
+        elif operand != 'H' and int(operand) >= 2**self.qubits:
+            self.error = ParseError('{0} does not fit in {1} qubits'
+                                    .format(operand, self.qubits),
+                                    self.__start)
+            return
+        self.__operand = operand
+
+
+def parse_expression(text, qubits=3, base='dec'):
+    '''
+    ParsedExpression of text, raises ParseError
+    '''
+    return Parser(qubits, base).feed(text).result()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libpool
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Process pool for local simulations. Every worker process owns its own QC
+(and QuantumProgram), so expressions or shot chunks run on all cores.
+'''
+
+import itertools
+import multiprocessing
+from collections import Counter
+
+from libqc import QC, sorted_answers, join_answers
+
+# worker-local calculator
+_WORKER_QC = None
+
+
+def _init_worker(config):
+    '''
+    pool initializer: create the worker-local QC
+    '''
+    global _WORKER_QC  # pylint: disable=global-statement
+    _WORKER_QC = QC(**config)
+
+
+def _worker_calc(args):
+    (text, base) = args
+    return _WORKER_QC.exec_calc(text, base, wait_result=True)
+
+
+def _worker_counts(args):
+    (text, base, shots, seed) = args
+    return _WORKER_QC.exec_counts(text, base, shots=shots, seed=seed)
+
+
+def input_pairs(qubits, operators='+-', base='dec'):
+    '''
+    all expressions "a<op>b" of qubits wide operands (for sweeps)
+    '''
+    if base == 'bin':
+        numbers = [format(i, '0{}b'.format(qubits))
+                   for i in range(2**qubits)]
+    else:
+        numbers = [str(i) for i in range(2**qubits)]
+    return ['{0}{1}{2}'.format(num_a, oper, num_b)
+            for (num_a, oper, num_b)
+            in itertools.product(numbers, operators, numbers)]
+
+
+class QCPool():
+    '''
+    pool of worker processes, each with a QC created from config
+    (keyword arguments of QC, e.g. {'qubits': 3}).
+    '''
+    def __init__(self, config=None, processes=None):
+        if config is None:
+            config = {}
+        self.config = dict(config)
+        self.qubits = int(self.config.get('qubits', 3))
+        self.processes = processes or multiprocessing.cpu_count()
+        self.__pool = multiprocessing.Pool(self.processes,
+                                           _init_worker, (self.config,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_args):
+        self.close()
+
+    def close(self):
+        '''
+        stop worker processes
+        '''
+        self.__pool.close()
+        self.__pool.join()
+
+    def map_calc(self, texts, base='dec', chunksize=1):
+        '''
+        evaluate expressions on the workers,
+        returns CalcResult for each expression in input order.
+        '''
+        return self.__pool.map(_worker_calc,
+                               [(text, base) for text in texts],
+                               chunksize)
+
+    def map_counts(self, texts, base='dec', shots=None):
+        '''
+        evaluate expressions on the workers,
+        returns counts dict (None if invalid) in input order.
+        '''
+        return self.__pool.map(_worker_counts,
+                               [(text, base, shots, 1) for text in texts])
+
+    def calc_shots(self, text, base='dec', shots=None, chunks=None):
+        '''
+        split the shots of one expression into chunks with different
+        seeds, run them on the workers and merge the counts.
+        returns (counts, ans), (None, None) if any chunk failed.
+        '''
+        if chunks is None:
+            chunks = self.processes
+        if shots is None:
+            shots = 5 * (2**self.qubits) if 'H' in text else 2
+        chunk_shots = [shots // chunks + (1 if i < shots % chunks else 0)
+                       for i in range(chunks)]
+        args = [(text, base, chunk, seed + 1)
+                for (seed, chunk) in enumerate(chunk_shots) if chunk > 0]
+
+        merged = Counter()
+        for counts in self.__pool.map(_worker_counts, args):
+            if counts is None:
+                return (None, None)
+            merged.update(counts)
+
+        counts = dict(merged)
+        return (counts, join_answers(sorted_answers(counts, self.qubits)))
@@ -7,10 +7,380 @@ Licence: Apache License 2.0
 '''
 
 import sys
-import re
+import math
+import time
+import logging
+import queue
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from qiskit import QuantumProgram, QISKitError, RegisterSizeError
+from libengine import (GateList, EngineError, format_clbits, run_classical,
+                       run_branches, run_sparse, sample_counts,
+                       optimize_gates, circuit_depth, describe_gate)
+from libcache import LRUCache, DiskStore, TTLCache, content_hash
+from libresult import CalcResult
+from libmetrics import Metrics, profile_call
+from libjobs import JobQueue, JobError
+from libparse import ParseError, ParsedExpression, parse_expression
+
+# calculation log, silent unless the application configures logging
+LOGGER = logging.getLogger('qc')
+LOGGER.addHandler(logging.NullHandler())
+
+
+# backend name of libengine.run_sparse
+SPARSE_BACKEND = 'local_sparse_simulator'
+
+# QISKit backends without counts in their results (unitary, clifford)
+UNSUPPORTED_BACKENDS = ('local_unitary_simulator',
+                        'local_clifford_simulator')
+
+# engines of the router in cost order, the first three are libengine
+ENGINES = ('classical', 'branches', 'sparse', 'dense', 'remote')
+LOCAL_ENGINES = ENGINES[:3]
+
+# adder bodies (set_config 'adder', auto chooses by width and backend)
+ADDERS = ('ripple', 'cla')
+# narrowest operands auto builds with the carry-lookahead adder
+CLA_MIN_QUBITS = 4
+
+
+class MemoryBudgetError(Exception):
+    '''
+    every capable engine needs more memory than the budget
+    '''
+
+
+def format_bytes(size):
+    '''
+    human readable size
+    '''
+    for unit in ('B', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if size < 1024 or unit == 'TiB':
+            break
+        size /= 1024
+    return '{0:.1f} {1}'.format(size, unit)
+
+
+# QISKit is imported on first use, it dominates the start up time
+_QISKIT = None
+
+
+def qiskit_module():
+    '''
+    import qiskit once and return it
+    '''
+    global _QISKIT  # pylint: disable=global-statement
+    if _QISKIT is None:
+        import qiskit
+        _QISKIT = qiskit
+    return _QISKIT
+
+
+def qiskit_errors():
+    '''
+    exceptions of QISKit (and failed remote jobs) handled as circuit
+    failures
+    '''
+    qiskit = qiskit_module()
+    return (qiskit.QISKitError, qiskit.RegisterSizeError, JobError)
+
+
+# quantum ripple-carry adder from Cuccaro et al, quant-ph/0410184
+# The builder functions below accept a QISKit circuit with its registers
+# or a libengine.GateList with its registers.
+def majority(circuit, q_a, q_b, q_c):
+    '''
+    majority
+    '''
+    circuit.cx(q_c, q_b)
+    circuit.cx(q_c, q_a)
+    circuit.ccx(q_a, q_b, q_c)
+
+
+def unmaj(circuit, q_a, q_b, q_c):
+    '''
+    unmajority
+    '''
+    circuit.ccx(q_a, q_b, q_c)
+    circuit.cx(q_c, q_a)
+    circuit.cx(q_a, q_b)
+
+
+def adder(circuit, c_in, q_a, q_b, c_out, qubits):
+    '''
+    adder
+    '''
+    # pylint: disable=too-many-arguments
+    majority(circuit, c_in[0], q_b[0], q_a[0])
+    for i in range(qubits - 1):
+        majority(circuit, q_a[i], q_b[i + 1], q_a[i + 1])
+
+    circuit.cx(q_a[qubits - 1], c_out[0])
+
+    for i in range(qubits - 1)[::-1]:
+        unmaj(circuit, q_a[i], q_b[i + 1], q_a[i + 1])
+    unmaj(circuit, c_in[0], q_b[0], q_a[0])
+
+
+# logarithmic depth carry-lookahead adder from Draper et al,
+# quant-ph/0406142, in place with the carry in cin folded into carry 1.
+# The carries are computed into the ancilla register anc and erased with
+# the carry circuit of the complemented sum.
+def cla_ancillas(qubits):
+    '''
+    ancilla qubits of the carry-lookahead adder: carries 1..qubits-1
+    and the propagate products of the lookahead tree
+    '''
+    products = 0
+    for level in range(1, qubits.bit_length() - 1):
+        products += qubits // 2**level - 1
+    return max(qubits - 1, 0) + products
+
+
+def carry_gates(c_in, q_a, q_b, carry, products, qubits):
+    '''
+    gates (name, qubits...) setting carry[i] ^= carry into bit i
+    (i = 1..qubits) of q_a + q_b + c_in and q_b ^= q_a, the propagate
+    products are erased again
+    '''
+    # pylint: disable=too-many-arguments
+    gates = [('ccx', q_a[i], q_b[i], carry[i + 1]) for i in range(qubits)]
+    gates += [('cx', q_a[i], q_b[i]) for i in range(qubits)]
+    gates.append(('ccx', c_in[0], q_b[0], carry[1]))
+
+    # propagate[level][m]: bits 2**level*m .. 2**level*(m+1)-1, m >= 1
+    propagate = [[None] + [q_b[i] for i in range(1, qubits)]]
+    rounds = qubits.bit_length() - 1
+    p_rounds = []
+    for level in range(1, rounds):
+        row = [None]
+        for m in range(1, qubits // 2**level):
+            row.append(products[len(p_rounds)])
+            p_rounds.append(('ccx', propagate[level - 1][2 * m],
+                             propagate[level - 1][2 * m + 1], row[m]))
+        propagate.append(row)
+    gates += p_rounds
+
+    # generate of the blocks, then the carries in between
+    for level in range(1, rounds + 1):
+        half = 2**(level - 1)
+        for m in range(qubits // 2**level):
+            gates.append(('ccx', carry[2 * half * m + half],
+                          propagate[level - 1][2 * m + 1],
+                          carry[2 * half * (m + 1)]))
+    for level in range(rounds, 0, -1):
+        half = 2**(level - 1)
+        for m in range(1, (qubits - half) // (2 * half) + 1):
+            gates.append(('ccx', carry[2 * half * m],
+                          propagate[level - 1][2 * m],
+                          carry[2 * half * m + half]))
+    gates += p_rounds[::-1]
+    return gates
+
+
+def cla_gates(c_in, q_a, q_b, c_out, anc, qubits):
+    '''
+    gates (name, qubits...) of the carry-lookahead adder
+    '''
+    # pylint: disable=too-many-arguments
+    carry = [None] + [anc[i] for i in range(qubits - 1)] + [c_out[0]]
+    products = [anc[i] for i in range(qubits - 1, cla_ancillas(qubits))]
+    gates = carry_gates(c_in, q_a, q_b, carry, products, qubits)
+    gates += [('cx', carry[i], q_b[i]) for i in range(1, qubits)]
+    gates.append(('cx', c_in[0], q_b[0]))
+    if qubits > 1:
+        # the carries of q_a + ~sum + c_in are the carries of the sum
+        low = range(qubits - 1)
+        gates += [('x', q_b[i]) for i in low]
+        gates += [('cx', q_a[i], q_b[i]) for i in low]
+        gates += carry_gates(c_in, q_a, q_b, carry[:qubits], products,
+                             qubits - 1)[::-1]
+        gates += [('x', q_b[i]) for i in low]
+    return gates
+
+
+def cla_adder(circuit, c_in, q_a, q_b, c_out, anc, qubits):
+    '''
+    carry-lookahead adder, same effect as adder. anc (cla_ancillas
+    qubits, None if 0) starts and ends in 0.
+    '''
+    # pylint: disable=too-many-arguments
+    for gate in cla_gates(c_in, q_a, q_b, c_out, anc, qubits):
+        getattr(circuit, gate[0])(*gate[1:])
+
+
+def adder_body(circuit, kind, q_r, qubits):
+    '''
+    adder of kind (ADDERS) on the quantum registers
+    q_r: [c_in, q_a, q_b, c_out] and anc for cla if it has ancillas
+    '''
+    if kind == 'cla':
+        anc = q_r[4] if len(q_r) > 4 else None
+        cla_adder(circuit, q_r[0], q_r[1], q_r[2], q_r[3], anc, qubits)
+    else:
+        adder(circuit, q_r[0], q_r[1], q_r[2], q_r[3], qubits)
+
+
+def char2q(circuit, cbit, qbit):
+    '''
+    char2q
+    '''
+    if cbit == '1':
+        circuit.x(qbit)
+    elif cbit == 'H':
+        circuit.h(qbit)
+
+
+def input_state(circuit, q_a, q_b, input_a, input_b=None):
+    '''
+    input state
+    '''
+    input_a = input_a[::-1]
+    for i, cbit in enumerate(input_a):
+        char2q(circuit, cbit, q_a[i])
+
+    if input_b is not None:
+        input_b = input_b[::-1]
+        for i, cbit in enumerate(input_b):
+            char2q(circuit, cbit, q_b[i])
+
+
+def reset_input(circuit, c_in, q_a, c_out, qubits):
+    '''
+    reset input
+    '''
+    circuit.reset(c_in)
+    circuit.reset(c_out)
+    for i in range(qubits):
+        circuit.reset(q_a[i])
+
+
+def measure(circuit, q_b, c_out, ans, qubits):
+    '''
+    measure
+    '''
+    circuit.barrier()
+    for i in range(qubits):
+        circuit.measure(q_b[i], ans[i])
+    circuit.measure(c_out[0], ans[qubits])
+
+
+def define_input(circuit, registers, operation, qubits):
+    '''
+    define input state of one operation of an expression.
+    registers: [c_in, q_a, q_b, c_out, ans]
+    operation: (input_a, input_b, subtract, observe) from QC.operations
+    '''
+    [c_in, q_a, q_b, c_out, _ans] = registers
+    (input_a, input_b, subtract, _observe) = operation
+    if input_b is not None:
+        if subtract is True:
+            # subtract
+            input_state(circuit, q_a, q_b, input_b, input_a)
+        else:
+            # add
+            input_state(circuit, q_a, q_b, input_a, input_b)
+    else:
+        reset_input(circuit, c_in, q_a, c_out, qubits)
+        input_state(circuit, q_a, q_b, input_a)
+
+
+def define_body(circuit, registers, body, operation, qubits):
+    '''
+    append adder or subtractor body (and measurement for the last
+    operation) of one operation of an expression.
+    '''
+    [_c_in, _q_a, q_b, c_out, ans] = registers
+    observe = operation[3]
+    circuit.extend(body)
+
+    if observe is True:
+        measure(circuit, q_b, c_out, ans, qubits)
+
+
+def sorted_answers(counts, qubits):
+    '''
+    counts -> [(answer, key, count)] most frequent first,
+    answer is OR when the carry bit is set
+    '''
+    sortedcounts = sorted(counts.items(),
+                          key=lambda x: -x[1])
+
+    sortedans = []
+    for (key, count) in sortedcounts:
+        if key[0] == '1':
+            ans = 'OR'
+        else:
+            ans = str(int(key[-qubits:], 2))
+        sortedans.append((ans, key, count))
+    return sortedans
+
+
+def join_answers(sortedans):
+    '''
+    comma joined unique answers of sorted_answers
+    '''
+    return ",".join(dict.fromkeys(ans for (ans, _key, _count) in sortedans))
+
+
+# backend metadata of every QC, key (session, kind, backend),
+# time to live of each kind in seconds
+METADATA = TTLCache()
+METADATA_TTL = {'backends': 300.0, 'status': 30.0, 'configuration': 3600.0}
+
+# remote API sessions by credentials, shared by every QC and backend
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def qconfig_credentials():
+    '''
+    set_api arguments of Qconfig.py
+    '''
+    import Qconfig
+
+    return {'token': Qconfig.APItoken,
+            'url': Qconfig.config['url'],
+            'hub': Qconfig.config['hub'],
+            'group': Qconfig.config['group'],
+            'project': Qconfig.config['project']}
+
+
+def remote_session(program, credentials=None):
+    '''
+    connect the QuantumProgram program to the remote API and return the
+    session key. The API session of the same credentials (Qconfig.py by
+    default) is created by the first set_api and reused afterwards.
+    '''
+    if credentials is None:
+        credentials = qconfig_credentials()
+    key = content_hash(*sorted(credentials.items()))
+    with _SESSIONS_LOCK:
+        api = _SESSIONS.get(key)
+        if api is None:
+            program.set_api(**credentials)
+            _SESSIONS[key] = program.get_api()
+        else:
+            # QuantumProgram has no setter for an open connection
+            program._QuantumProgram__api = api  # pylint: disable=W0212
+    return key
+
+
+def describe_instruction(gate):
+    '''
+    (name, qubits) of a QISKit instruction for libengine
+    '''
+    if gate.name == 'barrier':
+        return ('barrier', None)
+    quantum_register = qiskit_module().QuantumRegister
+    return (gate.name,
+            tuple((register.name, index)
+                  for (register, index) in gate.arg
+                  if isinstance(register, quantum_register)))
 
 
 class QC():
@@ -18,10 +388,37 @@ class QC():
     class QC
     '''
     # pylint: disable=too-many-instance-attributes
-    def __init__(self, backend='local_qasm_simulator', remote=False, qubits=3):
+    def __init__(self, backend='local_qasm_simulator', remote=False, qubits=3,
+                 fastpath=True, cache_size=32, cache_dir=None, max_jobs=4,
+                 optimize=True, exact=False, result_cache_size=256):
+        # pylint: disable=too-many-arguments
         # private member
         # __qp
         self.__qp = None
+        # key of the pooled remote API session (remote_session)
+        self.__session = None
+        # (width, adder) of registers and adder bodies in __qp
+        self.__layout = None
+        # compiled qobj cache
+        self.__qobj_cache = LRUCache(cache_size)
+        # compiled qobj store shared between processes
+        self.__qobj_store = None
+        # results of expressions without H (answers are determined),
+        # the disk tier shares cache_dir
+        self.__result_cache = LRUCache(result_cache_size)
+        self.__result_store = None
+        if cache_dir:
+            self.__qobj_store = DiskStore(cache_dir)
+            self.__result_store = DiskStore(cache_dir, suffix='.result.json')
+        # jobs: circuits of the quantum program are built under the lock,
+        # compiled jobs run concurrently on the executor
+        self.__lock = threading.RLock()
+        self.__executor = None
+        self.max_jobs = max_jobs
+        # durable queue of remote jobs (job_db path, job_rate per minute)
+        self.__job_queue = None
+        self.job_db = None
+        self.job_rate = 6.0
 
         # calc phase
         self.phase = [
@@ -31,75 +428,140 @@ class QC():
         self.backend = backend
         self.remote = remote
         self.qubits = qubits
+        self.fastpath = fastpath
+        self.optimize = optimize
+        # adder body: ripple, cla or auto (_adder)
+        self.adder = 'auto'
+        # exact outcome probabilities instead of shots (local backends)
+        self.exact = exact
+        # largest memory estimate the router accepts (bytes, 0: no limit)
+        self.memory_budget = 2**30
         # circuits variable
         self.shots = 2
+        # adaptive shots: rounds until every outcome frequency is within
+        # tolerance with the given confidence (backends without exact mode)
+        self.adaptive = False
+        self.confidence = 0.95
+        self.tolerance = 0.05
+        self.shots_round = 32
+        self.shots_max = 8192
         # async
         self.wait = False
         self.last = ['init', 'None']
+        # called with (phasename, text) on every phase
+        self.listener = None
+        # phase spans and counters
+        self.metrics = Metrics()
+        # cProfile and tracemalloc report of every exec_calc (set_config)
+        self.profile = False
+        self.profile_dir = 'profiles'
 
-        self.load()
+        # load() is deferred until the quantum program is needed
 
-    def load(self, api_info=True):
+    def load(self, api_info=False):
         '''
-        load
+        prepare the quantum program and return True if the backend is
+        available. The program is created once, so the circuits survive
+        backend switches; remote backends connect through the session
+        pool. api_info=True prints the API information (print_api_info).
         '''
-        self.__qp = QuantumProgram()
-        if self.remote:
+        if self.__qp is None:
+            self.__qp = qiskit_module().QuantumProgram()
+            self.__layout = None
+        if self.remote and self.__session is None:
             try:
-                import Qconfig
-                self.__qp.set_api(Qconfig.APItoken, Qconfig.config["url"],
-                                  hub=Qconfig.config["hub"],
-                                  group=Qconfig.config["group"],
-                                  project=Qconfig.config["project"])
-
+                self.__session = remote_session(self.__qp)
             except ImportError as ex:
-                msg = 'Error in loading Qconfig.py!. Error = {}\n'.format(ex)
-                sys.stdout.write(msg)
-                sys.stdout.flush()
+                LOGGER.error('Error in loading Qconfig.py!. Error = %s', ex)
                 return False
 
-            if api_info is True:
-                api = self.__qp.get_api()
-                sys.stdout.write('<IBM Quantum Experience API information>\n')
-                sys.stdout.flush()
-                sys.stdout.write('Version: {0}\n'.format(api.api_version()))
-                sys.stdout.write('User jobs (last 5):\n')
-                jobs = api.get_jobs(limit=500)
-
-                def format_date(job_item):
-                    '''
-                    format
-                    '''
-                    return datetime.strptime(job_item['creationDate'],
-                                             '%Y-%m-%dT%H:%M:%S.%fZ')
-                sortedjobs = sorted(jobs,
-                                    key=format_date)
-                sys.stdout.write('  {0:<32} {1:<24} {2:<9} {3}\n'
-                                 .format('id',
-                                         'creationDate',
-                                         'status',
-                                         'backend'))
-                sys.stdout.write('{:-^94}\n'.format(""))
-                for job in sortedjobs[-5:]:
-                    sys.stdout.write('  {0:<32} {1:<24} {2:<9} {3}\n'
-                                     .format(job['id'],
-                                             job['creationDate'],
-                                             job['status'],
-                                             job['backend']['name']))
-                sys.stdout.write('There are {0} jobs on the server\n'
-                                 .format(len(jobs)))
-                sys.stdout.write('Credits: {0}\n'
-                                 .format(api.get_my_credits()))
-                sys.stdout.flush()
-
-        self.backends = self.__qp.available_backends()
-        status = self.__qp.get_backend_status(self.backend)
+        if api_info is True and self.__session is not None:
+            self.print_api_info()
+
+        if self.backend == SPARSE_BACKEND:
+            return True
+        status = self._metadata('status', self.backend)
 
         if 'available' in status:
             if status['available'] is False:
                 return False
         return True
 
+    def job_history(self, limit=5, skip=0):
+        '''
+        one page of the jobs on the remote server (limit jobs after
+        skip, in the order of the API), [] if not connected
+        '''
+        if self.__session is None:
+            return []
+        return self.__qp.get_api().get_jobs(limit=limit, skip=skip)
+
+    def print_api_info(self, limit=5):
+        '''
+        print API version, the latest limit jobs and credits
+        '''
+        api = self.__qp.get_api()
+        sys.stdout.write('<IBM Quantum Experience API information>\n')
+        sys.stdout.write('Version: {0}\n'.format(api.api_version()))
+        sys.stdout.write('User jobs (last {0}):\n'.format(limit))
+
+        def format_date(job_item):
+            '''
+            format
+            '''
+            return datetime.strptime(job_item['creationDate'],
+                                     '%Y-%m-%dT%H:%M:%S.%fZ')
+        sortedjobs = sorted(self.job_history(limit), key=format_date)
+        sys.stdout.write('  {0:<32} {1:<24} {2:<9} {3}\n'
+                         .format('id',
+                                 'creationDate',
+                                 'status',
+                                 'backend'))
+        sys.stdout.write('{:-^94}\n'.format(""))
+        for job in sortedjobs:
+            sys.stdout.write('  {0:<32} {1:<24} {2:<9} {3}\n'
+                             .format(job['id'],
+                                     job['creationDate'],
+                                     job['status'],
+                                     job['backend']['name']))
+        sys.stdout.write('Credits: {0}\n'
+                         .format(api.get_my_credits()))
+        sys.stdout.flush()
+
+    @property
+    def backends(self):
+        '''
+        available backends (load() on first use, the list is cached
+        in METADATA)
+        '''
+        if self.__qp is None:
+            self.load()
+        return self._metadata('backends') + [SPARSE_BACKEND]
+
+    def _metadata(self, kind, backend=None):
+        '''
+        backends list, status or configuration of backend from the
+        shared METADATA cache (stale entries are refreshed in the
+        background)
+        '''
+        program = self.__qp
+        loaders = {
+            'backends': program.available_backends,
+            'status': lambda: program.get_backend_status(backend),
+            'configuration':
+                lambda: program.get_backend_configuration(backend),
+        }
+        return METADATA.get((self.__session, kind, backend), loaders[kind],
+                            METADATA_TTL[kind])
+
+    def _program(self):
+        '''
+        quantum program (load() on first use)
+        '''
+        if self.__qp is None:
+            self.load()
+        return self.__qp
+
     def set_config(self, config=None):
         '''
         set config
@@ -120,17 +582,85 @@ class QC():
         if 'qubits' in config:
             self.qubits = int(config['qubits'])
 
+        if 'fastpath' in config:
+            self.fastpath = bool(config['fastpath'])
+
+        if 'cache_size' in config:
+            self.__qobj_cache.maxsize = int(config['cache_size'])
+            self.__qobj_cache.clear()
+
+        if 'optimize' in config:
+            self.optimize = bool(config['optimize'])
+
+        if 'exact' in config:
+            self.exact = bool(config['exact'])
+
+        if 'adder' in config:
+            if config['adder'] not in ('auto',) + ADDERS:
+                raise ValueError('adder must be auto, {}'
+                                 .format(', '.join(ADDERS)))
+            self.adder = config['adder']
+
+        if 'memory_budget' in config:
+            self.memory_budget = int(config['memory_budget'])
+
+        if 'job_db' in config:
+            self.job_db = config['job_db'] or None
+
+        if 'job_rate' in config:
+            if float(config['job_rate']) <= 0:
+                raise ValueError('job_rate must be positive')
+            self.job_rate = float(config['job_rate'])
+
+        if 'profile' in config:
+            self.profile = bool(config['profile'])
+
+        if 'profile_dir' in config:
+            self.profile_dir = str(config['profile_dir'])
+
+        if 'adaptive' in config:
+            self.adaptive = bool(config['adaptive'])
+
+        for key in ('confidence', 'tolerance'):
+            if key in config:
+                setattr(self, key, float(config[key]))
+
+        for key in ('shots', 'shots_round', 'shots_max'):
+            if key in config:
+                if int(config[key]) <= 0:
+                    raise ValueError('{} must be positive'.format(key))
+                setattr(self, key, int(config[key]))
+
+        if 'max_jobs' in config:
+            self.max_jobs = int(config['max_jobs'])
+
+        if 'result_cache_size' in config:
+            self.__result_cache.maxsize = int(config['result_cache_size'])
+            self.__result_cache.clear()
+
+        if 'cache_dir' in config:
+            if config['cache_dir']:
+                self.__qobj_store = DiskStore(str(config['cache_dir']))
+                self.__result_store = DiskStore(str(config['cache_dir']),
+                                                suffix='.result.json')
+            else:
+                self.__qobj_store = None
+                self.__result_store = None
+
         return True
 
     def _progress(self, phasename, text):
+        self.metrics.phase(phasename, text)
         self.phase.append([str(phasename), str(text)])
-        text = "Phase {0}: {1}".format(phasename, text)
-        sys.stdout.write("{}\n".format(text))
-        sys.stdout.flush()
+        if self.listener is not None:
+            self.listener(str(phasename), str(text))
+        LOGGER.info('Phase %s: %s', phasename, text)
 
-    def _init_circuit(self):
+    def _init_circuit(self, name='qcirc'):
         self._progress('1', 'Initialize quantum registers and circuit')
+        self._program()
         qubits = self.qubits
+        kind = self._adder(self.remote)
 
         quantum_registers = [
             {"name": "cin", "size": 1},
@@ -138,188 +668,437 @@ class QC():
             {"name": "qb", "size": qubits},
             {"name": "cout", "size": 1}
             ]
+        if kind == 'cla' and cla_ancillas(qubits) > 0:
+            quantum_registers.append({"name": "anc",
+                                      "size": cla_ancillas(qubits)})
 
         classical_registers = [
             {"name": "ans", "size": qubits + 1}
             ]
 
-        if 'cin' in self.__qp.get_quantum_register_names():
-            self.__qp.destroy_quantum_registers(quantum_registers)
-            self.__qp.destroy_classical_registers(classical_registers)
-
-        q_r = self.__qp.create_quantum_registers(quantum_registers)
-        c_r = self.__qp.create_classical_registers(classical_registers)
-
-        self.__qp.create_circuit("qcirc", q_r, c_r)
+        if self.__layout == (qubits, kind):
+            # registers and adder bodies of this layout are reusable
+            q_r = [self.__qp.get_quantum_register(reg['name'])
+                   for reg in quantum_registers]
+            c_r = [self.__qp.get_classical_register(reg['name'])
+                   for reg in classical_registers]
+        else:
+            names = list(self.__qp.get_quantum_register_names())
+            if 'cin' in names:
+                # anc exists only in cla layouts
+                self.__qp.destroy_quantum_registers(
+                    [{"name": reg} for reg in names])
+                self.__qp.destroy_classical_registers(classical_registers)
 
-    def _create_circuit_qadd(self):
-        # quantum ripple-carry adder from Cuccaro et al, quant-ph/0410184
-        def majority(circuit, q_a, q_b, q_c):
-            '''
-            majority
-            '''
-            circuit.cx(q_c, q_b)
-            circuit.cx(q_c, q_a)
-            circuit.ccx(q_a, q_b, q_c)
+            q_r = self.__qp.create_quantum_registers(quantum_registers)
+            c_r = self.__qp.create_classical_registers(classical_registers)
+            self.__layout = (qubits, kind)
 
-        def unmaj(circuit, q_a, q_b, q_c):
-            '''
-            unmajority
-            '''
-            circuit.ccx(q_a, q_b, q_c)
-            circuit.cx(q_c, q_a)
-            circuit.cx(q_a, q_b)
+            self.__create_bodies(q_r, c_r, kind)
 
-        def adder(circuit, c_in, q_a, q_b, c_out, qubits):
-            '''
-            adder
-            '''
-            # pylint: disable=too-many-arguments
-            majority(circuit, c_in[0], q_b[0], q_a[0])
-            for i in range(qubits - 1):
-                majority(circuit, q_a[i], q_b[i + 1], q_a[i + 1])
-
-            circuit.cx(q_a[qubits - 1], c_out[0])
-
-            for i in range(qubits - 1)[::-1]:
-                unmaj(circuit, q_a[i], q_b[i + 1], q_a[i + 1])
-            unmaj(circuit, c_in[0], q_b[0], q_a[0])
-
-        if 'add' not in self.__qp.get_circuit_names():
-            [c_in, q_a, q_b, c_out] = map(self.__qp.get_quantum_register,
-                                          ["cin", "qa", "qb", "cout"])
-            ans = self.__qp.get_classical_register('ans')
-            qadder = self.__qp.create_circuit("qadd",
-                                              [c_in, q_a, q_b, c_out],
-                                              [ans])
-            adder(qadder, c_in, q_a, q_b, c_out, self.qubits)
-
-        return 'add' in self.__qp.get_circuit_names()
-
-    def _create_circuit_qsub(self):
-        circuit_names = self.__qp.get_circuit_names()
-        if 'qsub' not in circuit_names:
-            if 'qadd' not in circuit_names:
-                self._create_circuit_qadd()
-
-            # subtractor circuit
-            self.__qp.add_circuit('qsub', self.__qp.get_circuit('qadd'))
-            qsubtractor = self.__qp.get_circuit('qsub')
-            qsubtractor.reverse()
-        return 'qsub' in self.__qp.get_circuit_names()
-
-    def _qadd(self, input_a, input_b=None, subtract=False, observe=False):
-        # pylint: disable=too-many-locals
-
-        def measure(circuit, q_b, c_out, ans):
-            '''
-            measure
-            '''
-            circuit.barrier()
-            for i in range(self.qubits):
-                circuit.measure(q_b[i], ans[i])
-            circuit.measure(c_out[0], ans[self.qubits])
+        self.__qp.create_circuit(name, q_r, c_r)
 
-        def char2q(circuit, cbit, qbit):
-            '''
-            char2q
-            '''
-            if cbit == '1':
-                circuit.x(qbit)
-            elif cbit == 'H':
-                circuit.h(qbit)
-                self.shots = 5 * (2**self.qubits)
-
-        def input_state(circuit, input_a, input_b=None):
-            '''
-            input state
-            '''
-            input_a = input_a[::-1]
-            for i in range(self.qubits):
-                char2q(circuit, input_a[i], q_a[i])
-
-            if input_b is not None:
-                input_b = input_b[::-1]
-                for i in range(self.qubits):
-                    char2q(circuit, input_b[i], q_b[i])
+    def __create_bodies(self, q_r, c_r, kind):
+        '''
+        (re)create adder and subtractor bodies for the current registers
+        '''
+        qadder = self.__qp.create_circuit("qadd", q_r, c_r)
+        adder_body(qadder, kind, q_r, self.qubits)
 
-        def reset_input(circuit, c_in, q_a, c_out):
-            '''
-            reset input
-            '''
-            circuit.reset(c_in)
-            circuit.reset(c_out)
-            for i in range(self.qubits):
-                circuit.reset(q_a[i])
+        # subtractor circuit
+        qsubtractor = self.__qp.create_circuit("qsub", q_r, c_r)
+        adder_body(qsubtractor, kind, q_r, self.qubits)
+        qsubtractor.reverse()
 
+    def _adder(self, remote=False):
+        '''
+        adder of the circuits: the configured one, or for auto the
+        carry-lookahead adder on remote backends (their depth drives run
+        time and errors) from CLA_MIN_QUBITS if its ancillas fit
+        '''
+        if self.adder != 'auto':
+            return self.adder
+        if remote is not True or self.qubits < CLA_MIN_QUBITS:
+            return 'ripple'
+        self._program()
+        size = self._metadata('configuration', self.backend).get('n_qubits')
+        if size is not None and \
+                2 * self.qubits + 2 + cla_ancillas(self.qubits) > size:
+            return 'ripple'
+        return 'cla'
+
+    def _qadd(self, input_a, input_b=None, subtract=False, observe=False,
+              name='qcirc'):
+        # pylint: disable=too-many-arguments
         # get registers
-        [c_in, q_a, q_b, c_out] = map(self.__qp.get_quantum_register,
-                                      ["cin", "qa", "qb", "cout"])
-        ans = self.__qp.get_classical_register('ans')
-        qcirc = self.__qp.get_circuit('qcirc')
+        registers = list(map(self.__qp.get_quantum_register,
+                             ["cin", "qa", "qb", "cout"]))
+        registers.append(self.__qp.get_classical_register('ans'))
+        qcirc = self.__qp.get_circuit(name)
+        operation = (input_a, input_b, subtract, observe)
 
         self._progress('2',
                        'Define input state ({})'
                        .format('QADD' if subtract is False else 'QSUB'))
-        if input_b is not None:
-            if subtract is True:
-                # subtract
-                input_state(qcirc, input_b, input_a)
-            else:
-                # add
-                input_state(qcirc, input_a, input_b)
-        else:
-            reset_input(qcirc, c_in, q_a, c_out)
-            input_state(qcirc, input_a)
+        define_input(qcirc, registers, operation, self.qubits)
 
         self._progress('3',
                        'Define quantum circuit ({})'
                        .format('QADD' if subtract is False else 'QSUB'))
-        if subtract is True:
-            self._create_circuit_qsub()
-            qcirc.extend(self.__qp.get_circuit('qsub'))
-        else:
-            self._create_circuit_qadd()
-            qcirc.extend(self.__qp.get_circuit('qadd'))
-
-        if observe is True:
-            measure(qcirc, q_b, c_out, ans)
+        body = self.__qp.get_circuit('qsub' if subtract is True else 'qadd')
+        define_body(qcirc, registers, body, operation, self.qubits)
 
-    def _qsub(self, input_a, input_b=None, observe=False):
-        self._qadd(input_a, input_b, subtract=True, observe=observe)
+    def _qsub(self, input_a, input_b=None, observe=False, name='qcirc'):
+        self._qadd(input_a, input_b, subtract=True, observe=observe,
+                   name=name)
 
-    def _qope(self, input_a, operator, input_b=None, observe=False):
+    def _qope(self, input_a, operator, input_b=None, observe=False,
+              name='qcirc'):
+        # pylint: disable=too-many-arguments
         if operator == '+':
-            return self._qadd(input_a, input_b, observe=observe)
+            return self._qadd(input_a, input_b, observe=observe, name=name)
         elif operator == '-':
-            return self._qsub(input_a, input_b, observe=observe)
+            return self._qsub(input_a, input_b, observe=observe, name=name)
+        return None
+
+    @staticmethod
+    def operations(seq):
+        '''
+        yield (input_a, operator, input_b, observe) for each operator of
+        a sequence from get_seq. input_b is None after the first operator,
+        the running result stays in qb.
+        '''
+        numbers = seq[0::2]     # slice even index
+        for i, oper in enumerate(seq[1::2], 1):  # slice odd index
+            observe = i == len(numbers) - 1
+            if i == 1:
+                yield (numbers[0], oper, numbers[1], observe)
+            else:
+                yield (numbers[i], oper, None, observe)
+
+    def _define_circuit(self, seq, name='qcirc'):
+        '''
+        define circuit name of seq in the quantum program
+        '''
+        self._init_circuit(name)
+        for (input_a, oper, input_b, observe) in self.operations(seq):
+            self._qope(input_a, oper, input_b, observe=observe, name=name)
+        if self.optimize is True:
+            stats = self._optimize_circuit(name)
+            self.metrics.circuit(stats['gates_after'], stats['depth_after'])
+        else:
+            gates = self.__qp.get_circuit(name).data
+            self.metrics.circuit(len(gates),
+                                 circuit_depth(gates, describe_instruction))
+
+    def _optimize_circuit(self, name='qcirc'):
+        '''
+        peephole optimization of circuit name before compile,
+        returns gate count and depth savings
+        '''
+        circuit = self.__qp.get_circuit(name)
+        (circuit.data, stats) = optimize_gates(circuit.data,
+                                               describe_instruction)
+        self._progress('3', 'Optimize quantum circuit (gates {0} -> {1},'
+                       ' depth {2} -> {3})'
+                       .format(stats['gates_before'], stats['gates_after'],
+                               stats['depth_before'], stats['depth_after']))
+        return stats
+
+    def _build_gatelist(self, seq):
+        '''
+        build the circuit of seq as libengine.GateList
+        '''
+        qubits = self.qubits
+        kind = self._adder()
+        circuit = GateList('qcirc')
+        registers = [circuit.add_qreg('cin', 1),
+                     circuit.add_qreg('qa', qubits),
+                     circuit.add_qreg('qb', qubits),
+                     circuit.add_qreg('cout', 1),
+                     circuit.add_creg('ans', qubits + 1)]
+        q_r = registers[:4]
+        if kind == 'cla' and cla_ancillas(qubits) > 0:
+            q_r.append(circuit.add_qreg('anc', cla_ancillas(qubits)))
+        qadder = GateList('qadd')
+        adder_body(qadder, kind, q_r, qubits)
+        qsubtractor = qadder.copy('qsub').reverse()
+
+        for (input_a, oper, input_b, observe) in self.operations(seq):
+            operation = (input_a, input_b, oper == '-', observe)
+            define_input(circuit, registers, operation, qubits)
+            define_body(circuit, registers,
+                        qsubtractor if oper == '-' else qadder,
+                        operation, qubits)
+        return circuit
+
+    def _shots(self, seq):
+        '''
+        shots of seq: 5 * 2**qubits when an operand has H (the outcomes
+        are spread), otherwise self.shots
+        '''
+        if any('H' in num for num in seq[0::2]):
+            return 5 * (2**self.qubits)
+        return self.shots
+
+    def estimate(self, seq):
+        '''
+        cost of seq before anything is built: gate count and the memory
+        (bytes) of each engine, None where the engine is not capable.
+        classical needs a bit vector (no H), branches and sparse grow
+        with 2**(superposed qubits), dense with 2**(circuit qubits).
+        The local circuits use the adder _adder() chooses for them.
+        '''
+        qubits = self.qubits
+        width = 2 * qubits + 2
+        body = 6 * qubits + 1
+        if self._adder() == 'cla':
+            # the count does not depend on the qubit indices
+            width += cla_ancillas(qubits)
+            body = len(cla_gates([0], range(qubits), range(qubits), [0],
+                                 range(cla_ancillas(qubits)), qubits))
+        chain = len(seq) // 2
+        superposed = min(sum(num.count('H') for num in seq[0::2]), width)
+        gates = (body * chain + 2 * qubits +
+                 (chain - 1) * (2 * qubits + 2) + qubits + 1)
+        memory = {
+            'classical': 8 * width if superposed == 0 else None,
+            'branches': (32 * 2**superposed
+                         if 0 < superposed and width <= 64 else None),
+            'sparse': 96 * 2**superposed if width <= 64 else None,
+            'dense': 32 * 2**width,
+            'remote': 0,
+        }
+        return {'qubits': width, 'superposed': superposed, 'chain': chain,
+                'gates': gates, 'memory': memory}
+
+    def _engines(self, exact):
+        '''
+        engines allowed by the configuration in cost order
+        '''
+        if self.backend == SPARSE_BACKEND:
+            if self.fastpath is True or exact is True:
+                return list(LOCAL_ENGINES)
+            return ['sparse']
+        if self.remote is True:
+            return ['remote']
+        engines = []
+        if self.fastpath is True or exact is True:
+            engines.extend(LOCAL_ENGINES)
+        if exact is False:
+            engines.append('dense')
+        return engines
+
+    def route(self, seq, exact=None):
+        '''
+        estimate seq and choose the cheapest capable engine in the memory
+        budget. returns the estimate with 'engines' (usable, cost order)
+        and 'engine' (the first one), raises MemoryBudgetError.
+        '''
+        if exact is None:
+            exact = self.exact
+        plan = self.estimate(seq)
+        capable = [engine for engine in self._engines(exact)
+                   if plan['memory'][engine] is not None]
+        plan['engines'] = [engine for engine in capable
+                           if self.memory_budget <= 0 or
+                           plan['memory'][engine] <= self.memory_budget]
+        if plan['engines'] == []:
+            if capable == []:
+                raise MemoryBudgetError(
+                    'no engine can evaluate {0} circuit qubits'
+                    .format(plan['qubits']))
+            raise MemoryBudgetError(
+                '{0} circuit qubits ({1} superposed) need {2} on the {3} '
+                'engine, over the memory budget of {4}'
+                .format(plan['qubits'], plan['superposed'],
+                        format_bytes(plan['memory'][capable[0]]),
+                        capable[0], format_bytes(self.memory_budget)))
+        plan['engine'] = plan['engines'][0]
+        LOGGER.info('Route: %s engine (~%d gates, ~%s)', plan['engine'],
+                    plan['gates'],
+                    format_bytes(plan['memory'][plan['engine']]))
+        return plan
+
+    @staticmethod
+    def _reject(ex):
+        '''
+        log MemoryBudgetError ex, returns failed CalcResult
+        '''
+        LOGGER.error('Rejected: %s', ex)
+        return CalcResult('Rejected: {}'.format(ex))
+
+    def _engine_counts(self, seq, shots=None, seed=1, exact=False,
+                       plan=None, sample=False):
+        '''
+        evaluate seq on the local engines of the route (bit vector,
+        array of branches, sparse simulator) instead of compile and run,
+        returns counts, or probabilities if exact is True.
+        The branches engine returns branch multiplicities unless sample
+        is True, then shots are sampled with seed like on a simulator.
+        raises EngineError if no local engine could evaluate seq.
+        '''
+        # pylint: disable=too-many-arguments
+        if plan is None:
+            plan = self.route(seq, exact)
+        engines = [engine for engine in plan['engines']
+                   if engine in LOCAL_ENGINES]
+        if engines == []:
+            raise EngineError('no local engine for {0} on {1}'
+                              .format(seq, self.backend))
+
+        self._progress('1', 'Define reversible circuit (local engine)')
+        circuit = self._build_gatelist(seq)
+        self.metrics.circuit(len(circuit.gates),
+                             circuit_depth(circuit.gates, describe_gate))
+        if shots is None:
+            shots = self._shots(seq)
+
+        error = None
+        for engine in engines:
+            try:
+                return self._run_engine(engine, circuit, shots, seed, exact,
+                                        sample)
+            except EngineError as ex:
+                LOGGER.info('%s engine failed: %s', engine, ex)
+                error = ex
+        raise error
+
+    def _run_engine(self, engine, circuit, shots, seed, exact,
+                    sample=False):
+        '''
+        counts (probabilities if exact) of circuit on a local engine
+        '''
+        # pylint: disable=too-many-arguments
+        if engine == 'classical':
+            self._progress('5', 'Evaluate {} gates on a bit vector'
+                           .format(len(circuit.gates)))
+            (_state, clbits) = run_classical(circuit)
+            key = format_clbits(clbits, circuit.num_clbits)
+            return {key: 1.0 if exact is True else shots}
+
+        if engine == 'branches':
+            self._progress('5', 'Evaluate {} gates on superposed branches'
+                           .format(len(circuit.gates)))
+            counts = run_branches(circuit)
+            if exact is True:
+                total = sum(counts.values())
+                return {key: count / total
+                        for (key, count) in counts.items()}
+            if sample is True:
+                # multiplicities are the weights of the outcomes
+                self.metrics.count('shots', shots)
+                return sample_counts(counts, shots, seed)
+            return counts
+
+        if self.optimize is True:
+            (circuit.gates, _stats) = optimize_gates(circuit.gates)
+        self._progress('5', 'Run {} gates on the sparse simulator'
+                       .format(len(circuit.gates)))
+        probabilities = run_sparse(circuit)
+        if exact is True:
+            return probabilities
+        self.metrics.count('shots', shots)
+        return sample_counts(probabilities, shots, seed)
+
+    def _exec_engine(self, seq, plan=None):
+        '''
+        evaluate seq by the local engines, returns CalcResult
+        '''
+        result = self._parse_counts(
+            self._engine_counts(seq, exact=self.exact, plan=plan),
+            exact=self.exact)
+        LOGGER.info("All process done.")
+        return result
+
+    def _try_engine(self, seq, plan):
+        '''
+        CalcResult of seq on the local engines of plan,
+        None if seq goes to the backend
+        '''
+        if plan['engine'] not in LOCAL_ENGINES:
+            return None
+        try:
+            return self._exec_engine(seq, plan)
+        except EngineError as ex:
+            if plan['engines'][-1] in LOCAL_ENGINES:
+                LOGGER.error('Local engines failed. Error = %s', ex)
+                return CalcResult('FAIL: {}'.format(ex))
+            LOGGER.info('Fast path failed, fall back to %s. Error = %s',
+                        self.backend, ex)
         return None
 
-    def _compile(self, name, cross_backend=None, print_qasm=False):
+    def _compile(self, name, cross_backend=None, print_qasm=False,
+                 shots=None, seed=1):
+        '''
+        compile circuit name or list of circuit names into one qobj
+        '''
+        # pylint: disable=too-many-arguments
+        if shots is None:
+            shots = self.shots
         self._progress('4', 'Compile quantum circuit')
+        self._program()
+        names = [name] if isinstance(name, str) else list(name)
 
         coupling_map = None
         if cross_backend is not None:
-            backend_conf = self.__qp.get_backend_configuration(cross_backend)
+            backend_conf = self._metadata('configuration', cross_backend)
             coupling_map = backend_conf.get('coupling_map', None)
             if coupling_map is None:
-                sys.stdout.write('backend: {} coupling_map not found'
-                                 .format(cross_backend))
-
-        qobj = self.__qp.compile([name],
-                                 backend=self.backend,
-                                 shots=self.shots,
-                                 seed=1,
-                                 coupling_map=coupling_map)
+                LOGGER.warning('backend: %s coupling_map not found',
+                               cross_backend)
+
+        key = None
+        qobj = None
+        if self.__qobj_store is not None:
+            key = content_hash(names,
+                               [self.__qp.get_qasm(n) for n in names],
+                               self.backend, coupling_map, shots, seed)
+            qobj = self.__qobj_store.get(key)
+            self.metrics.count('store_misses' if qobj is None
+                               else 'store_hits')
+
+        if qobj is None:
+            qobj = self.__qp.compile(names,
+                                     backend=self.backend,
+                                     shots=shots,
+                                     seed=seed,
+                                     coupling_map=coupling_map)
+            if key is not None:
+                self.__qobj_store.put(key, qobj)
 
         if print_qasm is True:
-            sys.stdout.write(self.__qp.get_compiled_qasm(qobj, 'qcirc'))
+            for circuit_name in names:
+                sys.stdout.write(self.__qp.get_compiled_qasm(qobj,
+                                                             circuit_name))
             sys.stdout.flush()
         return qobj
 
+    def _durable(self):
+        '''
+        True if remote jobs go through the durable job queue
+        '''
+        return self.remote is True and self.job_db is not None
+
+    def job_queue(self):
+        '''
+        durable job queue of job_db (created on first use, jobs left
+        unfinished by an earlier process are reattached)
+        '''
+        with self.__lock:
+            if self.__job_queue is None:
+                self.__job_queue = JobQueue(self._program().get_api(),
+                                            self.job_db, rate=self.job_rate)
+            return self.__job_queue
+
     def _run(self, qobj):
         self._progress('5', 'Run quantum circuit (wait for answer)')
-        result = self.__qp.run(qobj, wait=5, timeout=100000)
+        self._program()
+        self.metrics.count('shots', qobj['config']['shots'])
+        with self.metrics.timer('job_wait_seconds'):
+            if self._durable():
+                return self.job_queue().run_qobj(qobj)
+            result = self.__qp.run(qobj, wait=5, timeout=100000)
         return result
 
     def _run_async(self, qobj):
@@ -327,150 +1106,525 @@ class QC():
         _run_async
         '''
         self._progress('5', 'Run quantum circuit')
+        self._program()
         self.wait = True
+        self.metrics.count('shots', qobj['config']['shots'])
+        start = time.monotonic()
 
         def async_result(result):
             '''
             async call back
             '''
+            self.metrics.count('job_wait_seconds', time.monotonic() - start)
             self.wait = False
             self.last = self.result_parse(result)
 
+        if self._durable():
+            job_queue = self.job_queue()
+
+            def wait_job():
+                '''
+                thread of a durable job
+                '''
+                try:
+                    async_result(job_queue.run_qobj(qobj))
+                except JobError as ex:
+                    self.wait = False
+                    self.last = self._fail(ex)
+
+            threading.Thread(name='qc_job_wait', target=wait_job,
+                             daemon=True).start()
+            return
+
         self.__qp.run_async(qobj,
                             wait=5, timeout=100000, callback=async_result)
 
-    def _is_regular_number(self, numstring, base):
+    def parse(self, text, base='dec'):
         '''
-        returns input binary format string or None.
+        ParsedExpression of text for the current qubits (a parsed text
+        of another width is parsed again), raises ParseError
         '''
-        if base == 'bin':
-            binstring = numstring
-        elif base == 'dec':
-            if numstring == 'H':
-                binstring = 'H'*self.qubits
-            else:
-                binstring = format(int(numstring), "0{}b".format(self.qubits))
-
-        if len(binstring) != self.qubits:
-            return None
-
-        return binstring
+        if isinstance(text, ParsedExpression):
+            if text.qubits == self.qubits:
+                return text
+            (text, base) = (text.text, text.base)
+        return parse_expression(text, self.qubits, base)
 
     def get_seq(self, text, base='dec'):
         '''
         convert seq and check it
         if text is invalid, return the list of length 0.
         '''
-        operators = u'(\\+|\\-)'
-        seq = re.split(operators, text)
-
-        # length check
-        if len(seq) % 2 == 0 or len(seq) == 1:
+        try:
+            return list(self.parse(text, base).seq)
+        except ParseError:
             return []
 
-        # regex
-        if base == 'bin':
-            regex = re.compile(r'[01H]+')
+    def _parse_counts(self, counts, exact=False, status='COMPLETED',
+                      info=None):
+        '''
+        CalcResult of counts (probabilities if exact is True),
+        the count table is logged at debug level
+        '''
+        result = CalcResult.from_counts(counts, self.qubits, status,
+                                        exact, info)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug('%s', result.format())
+        return result
+
+    def result_parse(self, result, name='qcirc'):
+        '''
+        CalcResult of circuit name in the QISKit result
+        '''
+        data = result.get_data(name)
+        LOGGER.debug('job id: %s', result.get_job_id())
+        LOGGER.debug('raw result: %s', data)
+
+        info = {'job_id': result.get_job_id()}
+        if 'time' in data:
+            info['time'] = data['time']
+            LOGGER.info('time: %s sec', data['time'])
+        LOGGER.info("All process done.")
+
+        return self._parse_counts(data['counts'], status=str(result),
+                                  info=info)
+
+    def _compiled(self, seq):
+        '''
+        define and compile circuit qcirc of seq (or reuse the cached qobj)
+        '''
+        shots = self._shots(seq)
+        key = (self.qubits, tuple(seq), self.backend, None, shots,
+               self._adder(self.remote))
+        qobj = self.__qobj_cache.get(key)
+        self.metrics.count('cache_misses' if qobj is None else 'cache_hits')
+        if qobj is None:
+            self._define_circuit(seq)
+            qobj = self._compile('qcirc', shots=shots)
+            self.__qobj_cache.put(key, qobj)
         else:
-            regex = re.compile(r'(^(?!.H)[0-9]+|H)')
+            self._progress('4', 'Reuse compiled quantum circuit')
+        return qobj
 
-        for i in range(0, len(seq), 2):
-            match = regex.match(seq[i])
-            if match is None:
-                return []
-            num = match.group(0)
-            seq[i] = self._is_regular_number(num, base)
+    def _confidence(self, shots, observed):
+        '''
+        lower bound of the probability that every outcome frequency of
+        shots is within tolerance: Hoeffding with a union bound over the
+        observed outcomes, plus the chance that an unobserved outcome
+        with probability >= tolerance was missed.
+        '''
+        outcomes = 2**(self.qubits + 1)
+        delta = (2 * observed * math.exp(-2 * shots * self.tolerance**2) +
+                 max(outcomes - observed, 0) *
+                 math.exp(-shots * self.tolerance))
+        return max(0.0, 1.0 - delta)
 
-            if seq[i] is None:
-                return []
+    def _needed_shots(self, shots, observed):
+        '''
+        shots (shots doubled, at most shots_max) at which the bound of
+        observed outcomes reaches the confidence
+        '''
+        while (shots < self.shots_max and
+               self._confidence(shots, observed) < self.confidence):
+            shots *= 2
+        return min(shots, self.shots_max)
 
-        return seq
+    def _exec_adaptive(self, seq):
+        '''
+        run seq in rounds of shots until the confidence is reached (or
+        shots_max is used up). The first round is sized by the bound for
+        the outcomes seq can have, so easy cases need one job.
+        '''
+        counts = Counter()
+        shots = 0
+        rounds = 0
+        superposed = self.estimate(seq)['superposed']
+        round_shots = self._needed_shots(
+            self.shots_round, 2**min(superposed, self.qubits + 1))
+        while True:
+            with self.__lock:
+                self._define_circuit(seq)
+                qobj = self._compile('qcirc', shots=round_shots,
+                                     seed=rounds + 1)
+            result = self._run(qobj)
+            counts.update(result.get_data('qcirc')['counts'])
+            shots += round_shots
+            rounds += 1
+
+            # the bound covers the outcomes not seen yet
+            confidence = self._confidence(shots, len(counts))
+            if shots >= self.shots_max or confidence >= self.confidence:
+                break
+
+            # next round: the shots the bound needs for the seen outcomes
+            needed = self._needed_shots(shots, len(counts))
+            round_shots = min(max(needed - shots, self.shots_round),
+                              self.shots_max - shots)
+
+        LOGGER.info('shots: %d in %d round%s, confidence: %.4f'
+                    ' (tolerance %s)', shots, rounds,
+                    '' if rounds == 1 else 's', confidence, self.tolerance)
+        LOGGER.info("All process done.")
+        status = ('{0} ({1} shots, confidence {2:.3f})'
+                  .format(str(result), shots, confidence))
+        return self._parse_counts(dict(counts), status=status,
+                                  info={'shots': shots, 'rounds': rounds,
+                                        'confidence': confidence})
+
+    @staticmethod
+    def _fail(ex):
+        '''
+        log fail message of QISKit error ex, returns failed CalcResult
+        '''
+        if isinstance(ex, qiskit_module().RegisterSizeError):
+            LOGGER.error('Error in the number of registers!. Error = %s', ex)
+        elif isinstance(ex, JobError):
+            LOGGER.error('Remote job failed!. Error = %s', ex)
+        else:
+            LOGGER.error('There was an error in the circuit!. Error = %s', ex)
+        return CalcResult("FAIL")
 
-    def result_parse(self, result):
+    def exec_calc(self, text, base='dec', wait_result=False):
+        '''
+        evaluate text (str or ParsedExpression), returns CalcResult
+        (unpacks as [status, ans]). With wait_result=False a job on the
+        backend returns a pending CalcResult (info['pending']), the
+        result arrives in self.last.
+        '''
+        self.metrics.count('calculations')
+        try:
+            if self.profile is True:
+                return profile_call(self.profile_dir,
+                                    {'expression': str(text),
+                                     'qubits': self.qubits,
+                                     'backend': self.backend},
+                                    self._exec_calc, text, base, wait_result)
+            return self._exec_calc(text, base, wait_result)
+        finally:
+            self.metrics.end()
+
+    def _memo_key(self, seq):
         '''
-        result_parse
+        result cache key of seq (binary operands, so dec and bin inputs
+        of the same numbers share it), None if seq has H. The backend is
+        part of the key, noisy device counts are not simulator answers.
         '''
-        data = result.get_data("qcirc")
-        sys.stdout.write("job id: {0}\n".format(result.get_job_id()))
-        sys.stdout.write("raw result: {0}\n".format(data))
-        sys.stdout.write("{:=^40}\n".format("answer"))
+        if any('H' in num for num in seq[0::2]):
+            return None
+        return (self.qubits, tuple(seq), self.exact, self.backend)
 
-        counts = data['counts']
-        sortedcounts = sorted(counts.items(),
-                              key=lambda x: -x[1])
+    def _memo_get(self, key):
+        '''
+        cached CalcResult of key (memory, then disk), None on a miss
+        '''
+        if key is None:
+            return None
+        result = self.__result_cache.get(key)
+        if result is None and self.__result_store is not None:
+            data = self.__result_store.get(content_hash(*key))
+            if data is not None:
+                result = CalcResult.from_dict(data)
+                self.__result_cache.put(key, result)
+        self.metrics.count('result_misses' if result is None
+                           else 'result_hits')
+        if result is not None:
+            self._progress('5', 'Reuse the result of {}'
+                           .format(''.join(key[1])))
+        return result
 
-        sortedans = []
-        for count in sortedcounts:
-            if count[0][0] == '1':
-                ans = 'OR'
-            else:
-                ans = str(int(count[0][-self.qubits:], 2))
-            sortedans.append(ans)
-            sys.stdout.write('Dec: {0:>2} Bin: {1} Count: {2} \n'
-                             .format(ans, str(count[0]), str(count[1])))
-
-        sys.stdout.write('{0:d} answer{1}\n'
-                         .format(len(sortedans),
-                                 '' if len(sortedans) == 1 else 's'))
-        sys.stdout.write("{:=^40}\n".format(""))
-        if 'time' in data:
-            sys.stdout.write("time: {0:<3} sec\n".format(data['time']))
-        sys.stdout.write("All process done.\n")
-        sys.stdout.flush()
+    def _memo_put(self, key, result):
+        '''
+        cache a successful CalcResult of key
+        '''
+        if key is None or not result.ok:
+            return
+        self.__result_cache.put(key, result)
+        if self.__result_store is not None:
+            self.__result_store.put(content_hash(*key), result.to_dict())
 
-        uniqanswer = sorted(set(sortedans), key=sortedans.index)
+    def _exec_calc(self, text, base, wait_result):
+        try:
+            seq = list(self.parse(text, base).seq)
+        except ParseError as ex:
+            return CalcResult('Syntax error: {}'.format(ex))
+        LOGGER.debug('QC seq: %s', seq)
+
+        key = self._memo_key(seq)
+        result = self._memo_get(key)
+        if result is None:
+            result = self._evaluate(seq, wait_result)
+            self._memo_put(key, result)
+        else:
+            self.last = result
+        return result
 
-        ans = ",".join(uniqanswer)
+    def _evaluate(self, seq, wait_result):
+        '''
+        route and evaluate seq
+        '''
+        try:
+            plan = self.route(seq)
+        except MemoryBudgetError as ex:
+            return self._reject(ex)
 
-        return [str(result), ans]
+        result = self._try_engine(seq, plan)
+        if result is not None:
+            self.last = result
+            return result
 
-    def exec_calc(self, text, base='dec', wait_result=False):
+        try:
+            if wait_result is True and self.adaptive is True:
+                return self._exec_adaptive(seq)
+
+            with self.__lock:
+                qobj = self._compiled(seq)
+
+            if wait_result is True:
+                return self.result_parse(self._run(qobj))
+            self._run_async(qobj)
+
+        except qiskit_errors() as ex:
+            return self._fail(ex)
+
+        # pending: the result arrives in self.last
+        return CalcResult('Wait. Calculating on {0}'.format(self.backend),
+                          info={'pending': True})
+
+    def submit(self, text, base='dec'):
+        '''
+        start a job and return concurrent.futures.Future of CalcResult.
+        up to max_jobs jobs run at once, every job has its own result.
+        '''
+        with self.__lock:
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.max_jobs,
+                    thread_name_prefix='qc_job')
+        return self.__executor.submit(self.exec_calc, text, base,
+                                      wait_result=True)
+
+    async def calc(self, text, base='dec'):
+        '''
+        asyncio version of submit, returns CalcResult
+        '''
+        return await asyncio.wrap_future(self.submit(text, base))
+
+    def close(self):
         '''
-        exec_calc
+        wait for running jobs, stop the job executor and the durable job
+        queue (its unfinished jobs are reattached by the next queue)
+        '''
+        with self.__lock:
+            executor = self.__executor
+            self.__executor = None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self.__lock:
+            job_queue = self.__job_queue
+            self.__job_queue = None
+        if job_queue is not None:
+            job_queue.close()
+
+    def exec_batch(self, texts, base='dec'):
+        '''
+        evaluate a list of expressions with one compile and one run job.
+        returns CalcResult for each expression in input order.
+        '''
+        self.metrics.count('calculations', len(texts))
+        try:
+            return self._exec_batch(texts, base)
+        finally:
+            self.metrics.end()
+
+    def _exec_batch(self, texts, base):
+        answers = [None] * len(texts)
+        circuits = []
+        for (index, text) in enumerate(texts):
+            try:
+                seq = list(self.parse(text, base).seq)
+            except ParseError as ex:
+                answers[index] = CalcResult('Syntax error: {}'.format(ex))
+                continue
+
+            answers[index] = self._memo_get(self._memo_key(seq))
+            if answers[index] is not None:
+                continue
+
+            try:
+                plan = self.route(seq)
+            except MemoryBudgetError as ex:
+                answers[index] = self._reject(ex)
+                continue
+
+            answers[index] = self._try_engine(seq, plan)
+            if answers[index] is not None:
+                self._memo_put(self._memo_key(seq), answers[index])
+                continue
+
+            circuits.append((index, 'qcirc{}'.format(index), seq))
+
+        if circuits == []:
+            return answers
+
+        try:
+            with self.__lock:
+                for (_index, name, seq) in circuits:
+                    self._define_circuit(seq, name)
+                shots = max(self._shots(circuit[2]) for circuit in circuits)
+                qobj = self._compile([circuit[1] for circuit in circuits],
+                                     shots=shots)
+
+            result = self._run(qobj)
+            for (index, name, seq) in circuits:
+                answers[index] = self.result_parse(result, name)
+                self._memo_put(self._memo_key(seq), answers[index])
+
+        except qiskit_errors() as ex:
+            fail = self._fail(ex)
+            for (index, _name, _seq) in circuits:
+                answers[index] = fail
+
+        return answers
+
+    def exec_counts(self, text, base='dec', shots=None, seed=1):
+        '''
+        evaluate text and return raw counts {clbits: count},
+        None if text is invalid, rejected or the circuit failed.
         '''
         seq = self.get_seq(text, base)
-        print('QC seq:', seq)
         if seq == []:
-            return ["Syntax error", None]
+            return None
 
-        # fail message
-        fail_msg = None
+        try:
+            plan = self.route(seq, exact=False)
+        except MemoryBudgetError as ex:
+            self._reject(ex)
+            return None
+
+        if plan['engine'] in LOCAL_ENGINES:
+            try:
+                return self._engine_counts(seq, shots, seed, plan=plan,
+                                           sample=True)
+            except EngineError:
+                if plan['engines'][-1] in LOCAL_ENGINES:
+                    return None
+
+        if shots is None:
+            shots = self._shots(seq)
 
         try:
-            self._init_circuit()
-            numbers = seq[0::2]     # slice even index
-            i = 1
-            observe = False
-            for oper in seq[1::2]:  # slice odd index
-                if i == len(numbers) - 1:
-                    observe = True
-                if i == 1:
-                    self._qope(numbers[0], oper, numbers[1], observe=observe)
-                else:
-                    self._qope(numbers[i], oper, observe=observe)
-                i = i + 1
-
-            qobj = self._compile('qcirc')
+            with self.__lock:
+                self._define_circuit(seq)
+                qobj = self._compile('qcirc', shots=shots, seed=seed)
+            result = self._run(qobj)
+        except qiskit_errors() as ex:
+            self._fail(ex)
+            return None
 
-            if wait_result is True:
-                [status, ans] = self.result_parse(self._run(qobj))
-            else:
-                self._run_async(qobj)
-                [status, ans] = [
-                    'Wait. Calculating on {0}'.format(self.backend),
-                    '...'
-                    ]
-
-        except QISKitError as ex:
-            fail_msg = ('There was an error in the circuit!. Error = {}\n'
-                        .format(ex))
-        except RegisterSizeError as ex:
-            fail_msg = ('Error in the number of registers!. Error = {}\n'
-                        .format(ex))
-
-        if fail_msg is not None:
-            sys.stdout.write(fail_msg)
-            sys.stdout.flush()
-            return ["FAIL", None]
+        return result.get_data('qcirc')['counts']
+
+    def distribution(self, text, base='dec'):
+        '''
+        exact outcome probability distribution {answer: probability}
+        of text computed once from the final state, most probable first.
+        None if text is invalid, rejected or the backend is remote
+        (no exact probabilities).
+        '''
+        seq = self.get_seq(text, base)
+        if seq == [] or self.remote is True:
+            return None
+
+        try:
+            exact = self._engine_counts(seq, exact=True)
+        except MemoryBudgetError as ex:
+            self._reject(ex)
+            return None
+
+        probabilities = {}
+        for (ans, _key, prob) in sorted_answers(exact, self.qubits):
+            probabilities[ans] = probabilities.get(ans, 0.0) + prob
+        return dict(sorted(probabilities.items(), key=lambda x: -x[1]))
+
+    def _prepare(self, text, base):
+        '''
+        first stage of exec_stream: parse, build and compile text.
+        returns ('done', CalcResult) or ('qobj', qobj)
+        '''
+        try:
+            seq = list(self.parse(text, base).seq)
+        except ParseError as ex:
+            return ('done', CalcResult('Syntax error: {}'.format(ex)))
+
+        try:
+            plan = self.route(seq)
+        except MemoryBudgetError as ex:
+            return ('done', self._reject(ex))
+
+        result = self._try_engine(seq, plan)
+        if result is not None:
+            return ('done', result)
+
+        try:
+            with self.__lock:
+                return ('qobj', self._compiled(seq))
+        except qiskit_errors() as ex:
+            return ('done', self._fail(ex))
 
-        return [status, ans]
+    def _finish(self, prepared):
+        '''
+        second stage of exec_stream: run the compiled qobj,
+        returns CalcResult
+        '''
+        (kind, payload) = prepared
+        if kind == 'done':
+            return payload
+        try:
+            result = self._run(payload)
+        except qiskit_errors() as ex:
+            return self._fail(ex)
+        return self._parse_counts(result.get_data('qcirc')['counts'],
+                                  status=str(result))
+
+    def exec_stream(self, lines, base='dec', depth=2):
+        '''
+        evaluate an iterable of expression lines (blank lines are skipped)
+        and yield one dict per expression in input order:
+        {"line", "text", "status", "answer", "counts"}.
+        The next expressions (up to depth) are parsed, built and compiled
+        on a thread while the current one runs.
+        '''
+        jobs = queue.Queue(maxsize=depth)
+        errors = []
+
+        def prepare():
+            '''
+            first stage thread
+            '''
+            try:
+                for (index, line) in enumerate(lines, 1):
+                    text = line.strip()
+                    if text != '':
+                        self.metrics.count('calculations')
+                        prepared = self._prepare(text, base)
+                        self.metrics.end()
+                        jobs.put((index, text, prepared))
+            except Exception as ex:  # pylint: disable=broad-except
+                errors.append(ex)
+            finally:
+                jobs.put(None)
+
+        thread = threading.Thread(name='qc_stream', target=prepare,
+                                  daemon=True)
+        thread.start()
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            (index, text, prepared) = job
+            result = self._finish(prepared)
+            self.metrics.end()
+            yield {'line': index, 'text': text, 'status': result.status,
+                   'answer': result.answer, 'counts': result.counts_dict()}
+        thread.join()
+        if errors:
+            raise errors[0]
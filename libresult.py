@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libresult
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+CalcResult keeps the outcomes of a calculation as NumPy arrays, the human
+readable forms (answer string, count table) are built on first use.
+'''
+
+# widest clbits (qubits + 1) kept in int64 arrays
+WIDE_QUBITS = 63
+
+
+class CalcResult():
+    '''
+    result of a calculation, most frequent outcome first.
+
+    codes     clbit values (uint64), the carry bit is bit qubits
+    counts    shot counts (int64) or probabilities (float64) if exact
+    answers   decoded answers, codes without the carry bit (int64)
+    codes and answers hold Python ints (dtype object) when the clbits
+    do not fit in WIDE_QUBITS bits.
+    overflow  True where the carry bit is set (answer OR)
+
+    Unpacks like the former [status, ans] list.
+    '''
+    __slots__ = ('status', 'qubits', 'exact', 'codes', 'counts',
+                 'answers', 'overflow', 'info', '_answer')
+
+    def __init__(self, status, qubits=0, codes=None, counts=None,
+                 exact=False, info=None):
+        # pylint: disable=too-many-arguments
+        self.status = status
+        self.qubits = qubits
+        self.exact = exact
+        self.info = {} if info is None else info
+        self._answer = None
+        self.codes = None
+        self.counts = None
+        self.answers = None
+        self.overflow = None
+        if codes is not None:
+            import numpy as np
+
+            counts = np.asarray(counts,
+                                dtype=np.float64 if exact else np.int64)
+            order = np.argsort(-counts, kind='stable')
+            self.counts = counts[order]
+            if qubits + 1 > WIDE_QUBITS:
+                # Python ints, the codes do not fit in 64 bits
+                codes = np.array([int(code) for code in codes],
+                                 dtype=object)[order]
+                self.codes = codes
+                self.answers = codes & ((1 << qubits) - 1)
+                self.overflow = (codes >> qubits & 1 == 1).astype(bool)
+            else:
+                self.codes = np.asarray(codes, dtype=np.uint64)[order]
+                self.answers = (self.codes & np.uint64((1 << qubits) - 1)
+                                ).astype(np.int64)
+                self.overflow = (self.codes >> np.uint64(qubits)) & 1 == 1
+
+    @classmethod
+    def from_counts(cls, counts, qubits, status='COMPLETED', exact=False,
+                    info=None):
+        '''
+        result of a counts dict {clbits string: count or probability}
+        '''
+        # pylint: disable=too-many-arguments
+        return cls(status, qubits,
+                   [int(key.replace(' ', ''), 2) for key in counts],
+                   list(counts.values()), exact, info)
+
+    @classmethod
+    def from_dict(cls, data):
+        '''
+        result of to_dict
+        '''
+        return cls(data['status'], data['qubits'], data['codes'],
+                   data['counts'], data['exact'], data['info'])
+
+    def to_dict(self):
+        '''
+        JSON serializable form (from_dict)
+        '''
+        return {'status': self.status, 'qubits': self.qubits,
+                'exact': self.exact,
+                'codes': None if self.codes is None else self.codes.tolist(),
+                'counts': (None if self.counts is None
+                           else self.counts.tolist()),
+                'info': self.info}
+
+    def __iter__(self):
+        return iter((self.status, self.answer))
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        return (self.status, self.answer)[index]
+
+    def __repr__(self):
+        return 'CalcResult({0!r}, {1!r})'.format(self.status, self.answer)
+
+    def __str__(self):
+        return self.format()
+
+    @property
+    def ok(self):  # pylint: disable=invalid-name
+        '''
+        True if the calculation has outcomes
+        '''
+        return self.codes is not None
+
+    @property
+    def answer(self):
+        '''
+        comma joined unique answers (most frequent first), None if failed
+        '''
+        if self.codes is None:
+            return None
+        if self._answer is None:
+            self._answer = ",".join(dict.fromkeys(
+                'OR' if overflow else str(ans)
+                for (ans, overflow) in zip(self.answers.tolist(),
+                                           self.overflow.tolist())))
+        return self._answer
+
+    def keys(self):
+        '''
+        clbits strings of the outcomes
+        '''
+        if self.codes is None:
+            return []
+        width = '0{}b'.format(self.qubits + 1)
+        return [format(code, width) for code in self.codes.tolist()]
+
+    def counts_dict(self):
+        '''
+        {clbits string: count or probability}, None if failed
+        '''
+        if self.codes is None:
+            return None
+        return dict(zip(self.keys(), self.counts.tolist()))
+
+    def format(self):
+        '''
+        count table as written to the log
+        '''
+        if self.codes is None:
+            return str(self.status)
+        lines = ["{:=^40}".format("answer")]
+        for (ans, overflow, key, count) in zip(self.answers.tolist(),
+                                               self.overflow.tolist(),
+                                               self.keys(),
+                                               self.counts.tolist()):
+            ans = 'OR' if overflow else str(ans)
+            if self.exact:
+                lines.append('Dec: {0:>2} Bin: {1} Prob: {2:.6f} '
+                             .format(ans, key, count))
+            else:
+                lines.append('Dec: {0:>2} Bin: {1} Count: {2} '
+                             .format(ans, key, count))
+        lines.append('{0:d} answer{1}'.format(len(self.codes),
+                                              '' if len(self.codes) == 1
+                                              else 's'))
+        lines.append("{:=^40}".format(""))
+        return "\n".join(lines)
@@ -4,14 +4,173 @@
 Quantum Calculator
 Author: Hideto Manjo
 Licence: Apache License 2.0
+
+python3 qc.py                    GUI
+python3 qc.py -e 1+2 -e H-1      headless, one answer per expression
+python3 qc.py --stream [FILE]    headless, one JSON result per input line
 '''
 
-from wx import App
-from interface import Calculator
+import time
+START_TIME = time.perf_counter()
 
-if __name__ == '__main__':
+# pylint: disable=wrong-import-position
+import sys  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import argparse  # noqa: E402
+import contextlib  # noqa: E402
+
+# start up budget of the headless mode in seconds (import and QC setup)
+STARTUP_BUDGET = 0.25
+
+
+def gui():
+    '''
+    start wx application
+    '''
+    from wx import App
+    from interface import Calculator
+
+    application = App()
+    frame = Calculator()
+    frame.Show()
+    application.MainLoop()
+
+
+def parse_args(argv=None):
+    '''
+    parse command line arguments
+    '''
+    parser = argparse.ArgumentParser(description='Quantum Calculator')
+    parser.add_argument('-e', '--expression', action='append', default=[],
+                        help='expression to calculate (repeatable), '
+                        'starts the headless mode')
+    parser.add_argument('--stream', nargs='?', const='-', default=None,
+                        metavar='FILE',
+                        help='read expressions line by line from FILE '
+                        '(default stdin) and write JSON lines')
+    parser.add_argument('--base', choices=['dec', 'bin'], default='dec')
+    parser.add_argument('--qubits', type=int, default=3)
+    parser.add_argument('--backend', default='local_qasm_simulator')
+    parser.add_argument('--no-fastpath', action='store_true',
+                        help='always compile and run on the backend')
+    parser.add_argument('--exact', action='store_true',
+                        help='exact outcome probabilities instead of shots')
+    parser.add_argument('--adder', choices=['auto', 'ripple', 'cla'],
+                        default='auto',
+                        help='ripple-carry or carry-lookahead adder '
+                        '(auto: cla on remote backends from 4 qubits)')
+    parser.add_argument('--memory-budget', type=int, default=2**30,
+                        metavar='BYTES',
+                        help='reject expressions whose cheapest engine '
+                        'needs more memory (0: no limit)')
+    parser.add_argument('--job-db', default=None, metavar='FILE',
+                        help='SQLite file of the durable remote job queue')
+    parser.add_argument('--cache-dir', default=None,
+                        help='directory of the compiled circuit store')
+    parser.add_argument('--time', action='store_true',
+                        help='report start up time against the budget')
+    parser.add_argument('--profile-dir', default=None, metavar='DIR',
+                        help='write cProfile and tracemalloc reports of '
+                        'every calculation to DIR')
+    parser.add_argument('--metrics', action='store_true',
+                        help='write phase timings and counters (JSON) '
+                        'to stderr at exit')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help='write calculation log to stderr '
+                        '(-vv with the count tables)')
+    return parser.parse_args(argv)
+
+
+def create_qc(args):
+    '''
+    QC of the headless modes
+    '''
+    from libqc import QC
+
+    qc = QC(backend=args.backend,
+            remote='local_' not in args.backend,
+            qubits=args.qubits,
+            fastpath=not args.no_fastpath,
+            cache_dir=args.cache_dir,
+            exact=args.exact)
+    qc.set_config({'memory_budget': args.memory_budget,
+                   'job_db': args.job_db,
+                   'adder': args.adder})
+    if args.profile_dir is not None:
+        qc.set_config({'profile': True, 'profile_dir': args.profile_dir})
+    return qc
 
-    APPLICATION = App()
-    FRAME = Calculator()
-    FRAME.Show()
-    APPLICATION.MainLoop()
+
+def stream(args):
+    '''
+    streaming mode, returns exit code
+    '''
+    qc = create_qc(args)
+    out = sys.stdout
+    infile = sys.stdin if args.stream == '-' else open(args.stream)
+    code = 0
+    try:
+        # keep stdout for the JSON lines
+        with contextlib.redirect_stdout(sys.stderr):
+            for result in qc.exec_stream(infile, args.base):
+                if result['answer'] is None:
+                    code = 1
+                out.write(json.dumps(result) + '\n')
+                out.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+    if args.metrics:
+        sys.stderr.write(qc.metrics.to_json(indent=1) + '\n')
+    return code
+
+
+def headless(args):
+    '''
+    calculate args.expression without GUI, returns exit code
+    '''
+    qc = create_qc(args)
+
+    startup = time.perf_counter() - START_TIME
+    if args.time:
+        sys.stderr.write('start up: {0:.3f} sec (budget {1:.3f} sec)\n'
+                         .format(startup, STARTUP_BUDGET))
+    if startup > STARTUP_BUDGET:
+        sys.stderr.write('warning: start up took {0:.3f} sec, over the '
+                         'budget of {1:.3f} sec\n'
+                         .format(startup, STARTUP_BUDGET))
+
+    code = 0
+    for text in args.expression:
+        [status, ans] = qc.exec_calc(text, args.base, wait_result=True)
+        if ans is None:
+            code = 1
+            sys.stdout.write('{0} : {1}\n'.format(text, status))
+        else:
+            sys.stdout.write('{0} = {1}\n'.format(text, ans))
+    sys.stdout.flush()
+    if args.metrics:
+        sys.stderr.write(qc.metrics.to_json(indent=1) + '\n')
+    return code
+
+
+def main(argv=None):
+    '''
+    main
+    '''
+    args = parse_args(argv)
+    if args.verbose > 0:
+        logging.basicConfig(stream=sys.stderr, format='%(message)s',
+                            level=(logging.DEBUG if args.verbose > 1
+                                   else logging.INFO))
+    if args.stream is not None:
+        return stream(args)
+    if args.expression:
+        return headless(args)
+    gui()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
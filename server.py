@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - headless HTTP/JSON server
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+POST /calc {"text": "1+2", "base": "dec"}
+    -> {"text": "1+2", "status": "COMPLETED", "answer": "3"}
+POST /calc {"expressions": ["1+2", "3-1"], "base": "dec"}
+    -> {"results": [{...}, {...}]}
+GET /health
+GET /metrics        Prometheus text format
+GET /metrics.json   JSON snapshot
+'''
+
+import sys
+import json
+import queue
+import argparse
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from libqc import QC
+
+
+class Coalescer():
+    '''
+    job queue in front of QC. Requests arriving within window seconds
+    of each other are coalesced into one QC.exec_batch call per base,
+    identical expressions are evaluated once.
+    '''
+    def __init__(self, qc, window=0.02, max_batch=64):
+        self.qc = qc
+        self.window = window
+        self.max_batch = max_batch
+        self.__queue = queue.Queue()
+        self.__thread = threading.Thread(name='coalescer',
+                                         target=self._loop,
+                                         daemon=True)
+        self.__thread.start()
+
+    def submit(self, text, base='dec'):
+        '''
+        queue an expression, returns Future of [status, ans]
+        '''
+        future = Future()
+        self.__queue.put((text, base, future))
+        return future
+
+    def _collect(self):
+        '''
+        block for the first request and collect the others of the window
+        '''
+        requests = [self.__queue.get()]
+        while len(requests) < self.max_batch:
+            try:
+                requests.append(self.__queue.get(timeout=self.window))
+            except queue.Empty:
+                break
+        return requests
+
+    def _loop(self):
+        while True:
+            requests = self._collect()
+
+            # group identical and compatible (same base) requests
+            batches = {}
+            for (text, base, future) in requests:
+                batches.setdefault(base, {}).setdefault(text, []).append(
+                    future)
+
+            for (base, texts) in batches.items():
+                try:
+                    answers = self.qc.exec_batch(list(texts), base)
+                except Exception as ex:  # pylint: disable=broad-except
+                    for futures in texts.values():
+                        for future in futures:
+                            future.set_exception(ex)
+                    continue
+                for (futures, answer) in zip(texts.values(), answers):
+                    for future in futures:
+                        future.set_result(answer)
+
+
+class CalcHandler(BaseHTTPRequestHandler):
+    '''
+    request handler, the server has qc and coalescer attributes
+    '''
+    def _send(self, code, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, code, data):
+        self._send(code, json.dumps(data), 'application/json')
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        '''
+        GET /health, /metrics, /metrics.json
+        '''
+        qc = self.server.qc
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok',
+                                  'backend': qc.backend,
+                                  'qubits': qc.qubits})
+        elif self.path == '/metrics':
+            self._send(200, qc.metrics.prometheus(),
+                       'text/plain; version=0.0.4')
+        elif self.path == '/metrics.json':
+            self._send_json(200, qc.metrics.snapshot())
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        '''
+        POST /calc
+        '''
+        if self.path != '/calc':
+            self._send_json(404, {'error': 'not found'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            base = str(request.get('base', 'dec'))
+            if 'expressions' in request:
+                texts = [str(text) for text in request['expressions']]
+            else:
+                texts = [str(request['text'])]
+        except (ValueError, KeyError, TypeError, AttributeError) as ex:
+            self._send_json(400, {'error': 'bad request: {}'.format(ex)})
+            return
+
+        if base not in ('dec', 'bin'):
+            self._send_json(400, {'error': 'base must be dec or bin'})
+            return
+
+        futures = [self.server.coalescer.submit(text, base)
+                   for text in texts]
+        results = []
+        for (text, future) in zip(texts, futures):
+            [status, ans] = future.result()
+            results.append({'text': text, 'status': status, 'answer': ans})
+
+        if 'expressions' in request:
+            self._send_json(200, {'results': results})
+        else:
+            self._send_json(200, results[0])
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        sys.stderr.write('{0} - {1}\n'.format(self.address_string(),
+                                              format % args))
+
+
+def make_server(qc, host='127.0.0.1', port=8000, window=0.02):
+    '''
+    create HTTP server for qc (serve with serve_forever)
+    '''
+    httpd = ThreadingHTTPServer((host, port), CalcHandler)
+    httpd.qc = qc
+    httpd.coalescer = Coalescer(qc, window=window)
+    return httpd
+
+
+def main(argv=None):
+    '''
+    main
+    '''
+    parser = argparse.ArgumentParser(description='Quantum Calculator server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--backend', default='local_qasm_simulator')
+    parser.add_argument('--qubits', type=int, default=3)
+    parser.add_argument('--window', type=float, default=0.02,
+                        help='coalescing window in seconds')
+    args = parser.parse_args(argv)
+
+    qc = QC(backend=args.backend,
+            remote='local_' not in args.backend,
+            qubits=args.qubits)
+    httpd = make_server(qc, args.host, args.port, args.window)
+    sys.stdout.write('Quantum Calculator server on http://{0}:{1}/\n'
+                     .format(args.host, httpd.server_port))
+    sys.stdout.flush()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - adder tests
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+Ripple-carry and carry-lookahead adders on libengine.GateList, evaluated
+on every input with the bit vector engine.
+python3 -m pytest -q test_adder.py
+'''
+
+import random
+import unittest
+
+from libengine import GateList, run_classical, circuit_depth, describe_gate
+from libqc import ADDERS, adder_body, cla_ancillas
+
+
+def build(kind, qubits):
+    '''
+    adder body of kind in the flat layout cin, qa, qb, cout (, anc)
+    '''
+    circuit = GateList('qadd')
+    q_r = [circuit.add_qreg('cin', 1),
+           circuit.add_qreg('qa', qubits),
+           circuit.add_qreg('qb', qubits),
+           circuit.add_qreg('cout', 1)]
+    if kind == 'cla' and cla_ancillas(qubits) > 0:
+        q_r.append(circuit.add_qreg('anc', cla_ancillas(qubits)))
+    adder_body(circuit, kind, q_r, qubits)
+    return circuit
+
+
+def state(qubits, c_in, q_a, q_b, c_out):
+    '''
+    bit vector of the registers (ancillas 0)
+    '''
+    return (c_in | q_a << 1 | q_b << (qubits + 1) |
+            c_out << (2 * qubits + 1))
+
+
+class TestAdder(unittest.TestCase):
+    '''
+    adder bodies
+    '''
+    def check(self, kind, qubits, inputs):
+        '''
+        add and subtract (reversed body) inputs (c_in, q_a, q_b, c_out),
+        q_a, c_in and the ancillas are restored
+        '''
+        qadd = build(kind, qubits)
+        qsub = qadd.copy('qsub').reverse()
+        mask = 2**qubits - 1
+        for (c_in, q_a, q_b, c_out) in inputs:
+            before = state(qubits, c_in, q_a, q_b, c_out)
+            total = q_a + q_b + c_in
+            (after, _clbits) = run_classical(qadd, before)
+            self.assertEqual(after, state(qubits, c_in, q_a, total & mask,
+                                          c_out ^ total >> qubits),
+                             (kind, qubits, c_in, q_a, q_b, c_out))
+            self.assertEqual(run_classical(qsub, after)[0], before)
+
+            difference = q_b - q_a - c_in
+            (after, _clbits) = run_classical(qsub, before)
+            self.assertEqual(after,
+                             state(qubits, c_in, q_a, difference & mask,
+                                   c_out ^ (difference < 0)),
+                             (kind, qubits, c_in, q_a, q_b, c_out))
+
+    def test_exhaustive(self):
+        for kind in ADDERS:
+            for qubits in range(1, 6):
+                inputs = [(c_in, q_a, q_b, c_out)
+                          for c_in in (0, 1) for c_out in (0, 1)
+                          for q_a in range(2**qubits)
+                          for q_b in range(2**qubits)]
+                self.check(kind, qubits, inputs)
+
+    def test_random_wide(self):
+        rand = random.Random(1)
+        for kind in ADDERS:
+            for qubits in range(6, 17):
+                inputs = [(rand.randrange(2), rand.randrange(2**qubits),
+                           rand.randrange(2**qubits), rand.randrange(2))
+                          for _ in range(200)]
+                self.check(kind, qubits, inputs)
+
+    def test_cla_depth(self):
+        for qubits in range(4, 33):
+            cla = build('cla', qubits).gates
+            ripple = build('ripple', qubits).gates
+            self.assertLess(circuit_depth(cla, describe_gate),
+                            circuit_depth(ripple, describe_gate), qubits)
+
+
+if __name__ == '__main__':
+    unittest.main()
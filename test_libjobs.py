@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libjobs tests
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+JobQueue against a fake IBMQuantumExperience API.
+python3 -m pytest -q test_libjobs.py
+'''
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from libjobs import JobQueue, JobError
+
+
+class ApiError(Exception):
+    '''
+    stand-in of the API errors of IBMQuantumExperience
+    '''
+
+
+class FakeAPI():
+    '''
+    run_job and get_job of IBMQuantumExperience. errors: exceptions
+    raised by the next run_job calls, polls: get_job calls before a job
+    is COMPLETED
+    '''
+    def __init__(self, errors=(), polls=0):
+        self.errors = list(errors)
+        self.polls = polls
+        self.submitted = []
+        self.checked = {}
+        self.lock = threading.Lock()
+
+    def run_job(self, qasms, backend, shots, max_credits):
+        '''
+        submit a job, returns {'id': job id}
+        '''
+        # pylint: disable=unused-argument
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.submitted.append(qasms)
+            return {'id': 'job{}'.format(len(self.submitted))}
+
+    def get_job(self, job_id):
+        '''
+        status and results of job_id
+        '''
+        with self.lock:
+            self.checked[job_id] = self.checked.get(job_id, 0) + 1
+            if self.checked[job_id] <= self.polls:
+                return {'status': 'RUNNING'}
+            return {'status': 'COMPLETED',
+                    'qasms': [{'result': {'data': {'counts': {'011': 2}}}}]}
+
+
+def request(qasm='OPENQASM 2.0;'):
+    '''
+    qobj_request of one circuit
+    '''
+    return {'names': ['qcirc'], 'qasms': [{'qasm': qasm}],
+            'backend': 'ibmqx4', 'shots': 2, 'max_credits': 10}
+
+
+class TestJobQueue(unittest.TestCase):
+    '''
+    JobQueue
+    '''
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'jobs.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def queue(self, api):
+        '''
+        fast JobQueue on the test database
+        '''
+        return JobQueue(api, self.path, rate=6000.0, backoff=0.01,
+                        backoff_max=0.02, poll=0.01)
+
+    def test_result(self):
+        api = FakeAPI(polls=2)
+        with self.queue(api) as jobs:
+            result = jobs.wait(jobs.submit(request()), timeout=5)
+        self.assertEqual(result.get_job_id(), 'job1')
+        self.assertEqual(result.get_data('qcirc')['counts'], {'011': 2})
+
+    def test_transient_errors_are_retried(self):
+        api = FakeAPI(errors=[OSError('reset'), OSError('reset')])
+        with self.queue(api) as jobs:
+            number = jobs.submit(request())
+            jobs.wait(number, timeout=5)
+            self.assertEqual(jobs.job(number)['status'], 'done')
+        self.assertEqual(len(api.submitted), 1)
+
+    def test_rate_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            JobQueue(FakeAPI(), self.path, rate=0)
+
+    def test_retries_used_up(self):
+        api = FakeAPI(errors=[OSError('reset')] * 10)
+        with JobQueue(api, self.path, rate=6000.0, retries=2, backoff=0.01,
+                      poll=0.01) as jobs:
+            with self.assertRaises(JobError):
+                jobs.wait(jobs.submit(request()), timeout=5)
+
+    def test_api_error_fails_the_job(self):
+        api = FakeAPI(errors=[ApiError('bad token')])
+        with self.queue(api) as jobs:
+            with self.assertRaisesRegex(JobError, 'bad token'):
+                jobs.wait(jobs.submit(request()), timeout=5)
+            # the worker is still alive
+            jobs.wait(jobs.submit(request('other')), timeout=5)
+
+    def test_reattach_after_restart(self):
+        api = FakeAPI(polls=10**6)
+        jobs = self.queue(api)
+        number = jobs.submit(request())
+        with self.assertRaises(TimeoutError):
+            jobs.wait(number, timeout=0.2)
+        jobs.close()
+
+        # the new process finishes the job before it asks for it again
+        api.polls = 0
+        with self.queue(api) as jobs:
+            for _ in range(500):
+                if jobs.job(number)['status'] == 'done':
+                    break
+                threading.Event().wait(0.01)
+            self.assertEqual(jobs.submit(request()), number)
+            jobs.wait(number, timeout=5)
+            self.assertEqual(len(api.submitted), 1)
+
+            # returned once, the next calculation is a new job
+            self.assertNotEqual(jobs.submit(request()), number)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+'''
+Quantum Calculator - libresult tests
+Author: Hideto Manjo
+Licence: Apache License 2.0
+
+CalcResult of narrow and wide (more than 63 clbits) circuits.
+python3 -m pytest -q test_libresult.py
+'''
+
+import json
+import unittest
+
+from libqc import QC
+from libresult import CalcResult
+
+
+class TestCalcResult(unittest.TestCase):
+    '''
+    CalcResult
+    '''
+    def test_counts(self):
+        result = CalcResult.from_counts({'0011': 2, '1000': 5}, 3)
+        self.assertEqual(result.answer, 'OR,3')
+        self.assertEqual(result.counts_dict(), {'1000': 5, '0011': 2})
+        [status, ans] = result
+        self.assertEqual((status, ans), ('COMPLETED', 'OR,3'))
+
+    def test_wide_counts(self):
+        top = '0' + '1' * 64
+        result = CalcResult.from_counts({top: 2, '1' + '0' * 64: 1}, 64)
+        self.assertEqual(result.answer, '{},OR'.format(2**64 - 1))
+        self.assertEqual(result.keys()[0], top)
+        data = json.loads(json.dumps(result.to_dict()))
+        self.assertEqual(CalcResult.from_dict(data).answer, result.answer)
+
+    def test_wide_calculation(self):
+        for (qubits, text, answer) in (
+                (64, '18446744073709551615+0', str(2**64 - 1)),
+                (64, '18446744073709551615+1', 'OR'),
+                (64, '0-1', 'OR'),
+                (70, '5+7', '12'),
+                (70, '{}-1'.format(2**70 - 1), str(2**70 - 2))):
+            qc = QC(qubits=qubits)
+            self.assertEqual(qc.exec_calc(text).answer, answer, text)
+
+
+if __name__ == '__main__':
+    unittest.main()